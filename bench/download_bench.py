@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from standin import StandinServer, add_standin_args, standin_config
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CODES_DIR = ROOT_DIR / 'codes'
+
+# pdf_writer and readiness live next to the downloaders
+sys.path.insert(0, str(CODES_DIR))
+from pdf_writer import build_chapter_pdf
+from readiness import READY_MARKER, read_marker
+
+ENGINES = ["sync", "async"]
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Measure download throughput of the downloaders against a local stand-in of mangaita.io')
+    parser.add_argument('-e', '--engine', action='append', choices=ENGINES, help='Downloader to measure (repeatable), default: all')
+    parser.add_argument('-c', '--config', action='append', default=[], metavar='KEY=VALUE',
+                        help='Override a config.json setting for the runs, VALUE is parsed as JSON (repeatable)')
+    parser.add_argument('--json', help='Print the results as JSON', action='store_true')
+    add_standin_args(parser)
+    return parser.parse_args()
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Peak resident set size of a finished child, in MB (ru_maxrss is KB on Linux, bytes on macOS)
+def peak_rss_mb(usage):
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# Config of one run: the repo's settings, pointed at the stand-in and a scratch library
+def write_config(work_dir, engine, base_url, overrides):
+    with open(ROOT_DIR / 'config' / 'config.json', 'r') as f:
+        config = json.load(f)
+    config.update(base_url=base_url, custom_save_path=str(work_dir / 'library'), download_type=engine, ready_markers=True)
+    config.update(overrides)
+    (work_dir / 'config').mkdir()
+    with open(work_dir / 'config' / 'config.json', 'w') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+
+# Build every chapter PDF again in this process, timed on its own
+def time_pdf_builds(library_dir):
+    folders = sorted({path.parent for path in library_dir.rglob("*.jpg")})
+    start = time.perf_counter()
+    for folder in folders:
+        build_chapter_pdf(folder)
+    return time.perf_counter() - start, len(folders)
+
+
+# Seconds from the start of the run to the first chapter marked ready, or None
+def first_ready_seconds(library_dir, started_at):
+    ready = [marker["ready_at"] for marker in map(read_marker, {path.parent for path in library_dir.rglob(READY_MARKER)})
+             if marker]
+    return round(min(ready) - started_at, 3) if ready else None
+
+
+# Download the whole stand-in series with one engine in a fresh process and library
+def run_engine(server, engine, overrides):
+    server.stats.reset()
+    with tempfile.TemporaryDirectory(prefix=f"bench-{engine}-") as work_dir:
+        work_dir = Path(work_dir)
+        write_config(work_dir, engine, server.base_url, overrides)
+        with open(work_dir / 'output.log', 'w') as log:
+            start, started_at = time.perf_counter(), time.time()
+            process = subprocess.Popen(
+                [sys.executable, str(CODES_DIR / f'{engine}_down.py'), '-u', f'{server.base_url}/manga/bench'],
+                cwd=work_dir, stdout=log, stderr=subprocess.STDOUT,
+            )
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+
+        stats = server.stats.snapshot()
+        first_ready = first_ready_seconds(work_dir / 'library', started_at)
+        pdf_seconds, chapters = time_pdf_builds(work_dir / 'library')
+        if process.returncode != 0:
+            print((work_dir / 'output.log').read_text(), file=sys.stderr)
+
+    latencies = stats["image_latencies"]
+    return {
+        "exit_code": process.returncode,
+        "seconds": round(seconds, 3),
+        "chapters": chapters,
+        "reader_pages": stats["reader_pages"],
+        "images": stats["images"],
+        "mb": round(stats["image_bytes"] / 1e6, 3),
+        "pages_per_s": round(stats["reader_pages"] / seconds, 2),
+        "images_per_s": round(stats["images"] / seconds, 2),
+        "mb_per_s": round(stats["image_bytes"] / 1e6 / seconds, 3),
+        "image_latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "image_latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "rate_limited": stats["rate_limited"],
+        "errors": stats["errors"],
+        "peak_rss_mb": round(peak_rss_mb(usage), 1),
+        "pdf_build_s": round(pdf_seconds, 3),
+        "first_ready_s": first_ready,
+    }
+
+
+def main():
+    args = get_args()
+    config = standin_config(args)
+    overrides = parse_overrides(args.config)
+
+    server = StandinServer(config)
+    server.start()
+    try:
+        results = {engine: run_engine(server, engine, overrides) for engine in args.engine or ENGINES}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if args.json:
+        print(json.dumps({"standin": vars(config), "config": overrides, "engines": results}, indent=2))
+    else:
+        for engine, result in results.items():
+            print(f"{engine:6} {result['seconds']:8.2f} s {result['pages_per_s']:8.2f} pages/s {result['mb_per_s']:8.2f} MB/s "
+                  f"p50 {result['image_latency_p50_ms']} ms p99 {result['image_latency_p99_ms']} ms "
+                  f"rss {result['peak_rss_mb']} MB pdf {result['pdf_build_s']:.2f} s first ready {result['first_ready_s']} s "
+                  f"({result['images']} images, {result['rate_limited']} 429s, {result['errors']} errors)")
+
+    # A failed run fails the benchmark, so CI notices
+    if any(result["exit_code"] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
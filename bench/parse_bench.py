@@ -0,0 +1,66 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# The extraction module lives next to the downloaders
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'codes'))
+import extract
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+# Saved pages and the extraction they go through
+FIXTURES = {
+    "series_page": ("series_page.html", "chapters"),
+    "reader_page": ("reader_page.html", "reader_page"),
+}
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Measure HTML extraction cost per page for each parser backend')
+    parser.add_argument('-r', '--rounds', type=int, help='Parses per fixture and backend', default=50)
+    parser.add_argument('-b', '--backend', action='append', help='Backend to measure (repeatable), default: all installed')
+    parser.add_argument('--json', help='Print the results as JSON', action='store_true')
+    return parser.parse_args()
+
+
+# Average seconds per parse of every fixture with one backend
+def time_backend(name, rounds):
+    backend = extract.BACKENDS[name]()
+    results = {}
+    for label, (file_name, method) in FIXTURES.items():
+        html = (FIXTURES_DIR / file_name).read_text(encoding='utf-8')
+        parse = getattr(backend, method)
+        found = parse(html)  # Warm up
+        start = time.perf_counter()
+        for _ in range(rounds):
+            parse(html)
+        seconds = (time.perf_counter() - start) / rounds
+        results[label] = {"ms_per_page": round(seconds * 1000, 3), "pages_per_s": round(1 / seconds, 1), "items": len(found[0]) if label == "reader_page" else len(found)}
+    return results
+
+
+def main():
+    args = get_args()
+    results = {}
+    for name in args.backend or extract.BACKEND_ORDER:
+        try:
+            results[name] = time_backend(name, args.rounds)
+        except ImportError:
+            results[name] = None  # Not installed
+
+    if args.json:
+        print(json.dumps({"rounds": args.rounds, "backends": results}, indent=2))
+        return
+
+    for name, timings in results.items():
+        if timings is None:
+            print(f"{name:12} not installed")
+            continue
+        for label, result in timings.items():
+            print(f"{name:12} {label:12} {result['ms_per_page']:9.3f} ms/page {result['pages_per_s']:10.1f} pages/s ({result['items']} items)")
+
+if __name__ == "__main__":
+    main()
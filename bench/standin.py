@@ -0,0 +1,202 @@
+import argparse
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+# Local imitation of mangaita.io for benchmarks: a series page listing chapters
+# in `col-chapter` divs, reader pages with scan <img> tags, the site logo and
+# a `btn-next` link to the following page, and JPEG scans of a fixed size.
+# Latency, server errors and 429s can be injected to exercise rate control.
+
+LOGO_SRC = "/assets/logo.2c1c1f72.webp"
+
+
+# Shape of the fake site and the faults it injects
+class StandinConfig:
+    def __init__(self, chapters=5, pages=4, images=5, image_size=(800, 1200), latency_ms=0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=0.5, seed=0):
+        self.chapters = chapters
+        self.pages = pages
+        self.images = images
+        self.image_size = image_size
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+# Seeded noise compresses about as badly as a real scan, so sizes are realistic
+def make_scan(width, height, seed):
+    rng = random.Random(seed)
+    image = Image.frombytes("L", (width, height), rng.randbytes(width * height)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def series_html(name, config):
+    chapters = "".join(
+        f'<div class="col-chapter"><a href="/scan/{name}-capitolo-{n}"><h5>Capitolo {n}\n<small>1 giorno fa</small></h5></a></div>'
+        for n in range(config.chapters, 0, -1)  # Latest first, as on the site
+    )
+    return f'<html><head><title>{name}</title></head><body><h1>{name}</h1>{chapters}</body></html>'
+
+
+def reader_html(chapter, page, config):
+    images = "".join(f'<img src="/images/{chapter}/{page}-{i}.jpg" alt="scan">' for i in range(config.images))
+    next_link = ""
+    if page < config.pages:
+        next_link = f'<a class="btn btn-primary btn-navigation btn-next" href="/scan/{chapter}/{page + 1}">Avanti</a>'
+    return f'<html><body><img src="{LOGO_SRC}" alt="logo">{images}{next_link}</body></html>'
+
+
+# Counters and per-image service times, read by the benchmark once a run is over
+class StandinStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.series_pages = 0
+            self.reader_pages = 0
+            self.images = 0
+            self.image_bytes = 0
+            self.image_latencies = []
+            self.errors = 0
+            self.rate_limited = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "series_pages": self.series_pages,
+                "reader_pages": self.reader_pages,
+                "images": self.images,
+                "image_bytes": self.image_bytes,
+                "image_latencies": list(self.image_latencies),
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+            }
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        started = time.perf_counter()
+        path = self.path.split("?")[0]
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000)
+
+        if path.startswith("/images/"):
+            with server.stats.lock:
+                roll = server.rng.random()
+            if roll < config.rate_limit_rate:
+                with server.stats.lock:
+                    server.stats.rate_limited += 1
+                return self.send_body(429, headers={"Retry-After": str(config.retry_after)})
+            if roll < config.rate_limit_rate + config.error_rate:
+                with server.stats.lock:
+                    server.stats.errors += 1
+                return self.send_body(500)
+
+            self.send_body(200, server.scan, "image/jpeg")
+            with server.stats.lock:
+                server.stats.images += 1
+                server.stats.image_bytes += len(server.scan)
+                server.stats.image_latencies.append(time.perf_counter() - started)
+        elif path.startswith("/scan/"):
+            parts = path.strip("/").split("/")
+            page = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
+            self.send_body(200, reader_html(parts[1], page, config).encode())
+            with server.stats.lock:
+                server.stats.reader_pages += 1
+        elif path.startswith("/manga/"):
+            self.send_body(200, series_html(path.rstrip("/").split("/")[-1], config).encode())
+            with server.stats.lock:
+                server.stats.series_pages += 1
+        elif path == LOGO_SRC:
+            self.send_body(200, b"", "image/webp")
+        else:
+            self.send_body(404)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), StandinHandler)
+        self.config = config
+        self.stats = StandinStats()
+        self.rng = random.Random(config.seed)
+        self.scan = make_scan(*config.image_size, config.seed)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # Serve from a background thread, for use inside a benchmark process
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def add_standin_args(parser):
+    parser.add_argument('--chapters', type=int, help='Chapters listed on the series page', default=5)
+    parser.add_argument('--pages', type=int, help='Reader pages per chapter', default=4)
+    parser.add_argument('--images', type=int, help='Scans per reader page', default=5)
+    parser.add_argument('--image-size', type=parse_size, help='Scan dimensions as WIDTHxHEIGHT', default=(800, 1200))
+    parser.add_argument('--latency-ms', type=float, help='Delay added to every response', default=0)
+    parser.add_argument('--error-rate', type=float, help='Fraction of image requests answered with 500', default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, help='Fraction of image requests answered with 429', default=0.0)
+    parser.add_argument('--retry-after', type=float, help='Retry-After seconds sent with 429 responses', default=0.5)
+    parser.add_argument('--seed', type=int, help='Seed for the scans and the injected faults', default=0)
+
+
+def standin_config(args):
+    return StandinConfig(args.chapters, args.pages, args.images, args.image_size, args.latency_ms,
+                         args.error_rate, args.rate_limit_rate, args.retry_after, args.seed)
+
+
+# Run the stand-in on its own, to point a downloader at it by hand
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local imitation of mangaita.io')
+    parser.add_argument('-p', '--port', type=int, help='Port to listen on', default=8765)
+    add_standin_args(parser)
+    args = parser.parse_args()
+
+    server = StandinServer(standin_config(args), port=args.port)
+    print(f"Serving on {server.base_url} (series page: {server.base_url}/manga/bench)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
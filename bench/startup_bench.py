@@ -0,0 +1,74 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CODES_DIR = ROOT_DIR / 'codes'
+
+sys.path.insert(0, str(CODES_DIR))
+from startup import startup_report
+
+ENGINES = ["sync", "async"]
+
+# A link that fails validation, so a run stops right after startup
+INVALID_URL = "https://invalid.example/"
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Check the cold start time of the downloaders against a budget')
+    parser.add_argument('-e', '--engine', action='append', choices=ENGINES, help='Downloader to measure (repeatable), default: all')
+    parser.add_argument('-n', '--runs', type=int, help='Runs per downloader, the median is compared with the budget', default=10)
+    parser.add_argument('-b', '--budget-ms', type=float, help='Allowed startup on top of a bare interpreter, in ms', default=150)
+    parser.add_argument('--json', help='Print the results as JSON', action='store_true')
+    return parser.parse_args()
+
+
+def wall_ms(command):
+    started = time.perf_counter()
+    subprocess.run(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+# Median wall time of a whole downloader run that exits at URL validation,
+# and of an interpreter that does nothing, measured alternately so both see
+# the same machine load
+def measure(engine, runs):
+    run, bare = [], []
+    for _ in range(runs):
+        bare.append(wall_ms([sys.executable, "-c", "pass"]))
+        run.append(wall_ms([sys.executable, str(CODES_DIR / f"{engine}_down.py"), "-u", INVALID_URL]))
+    return {
+        "median_ms": round(statistics.median(run), 1),
+        "max_ms": round(max(run), 1),
+        "bare_interpreter_ms": round(statistics.median(bare), 1),
+        "startup_ms": round(statistics.median(run) - statistics.median(bare), 1),
+    }
+
+
+def main():
+    args = get_args()
+    results = {engine: measure(engine, args.runs) for engine in args.engine or ENGINES}
+    over = [engine for engine, result in results.items() if result["startup_ms"] > args.budget_ms]
+
+    if args.json:
+        print(json.dumps({"budget_ms": args.budget_ms, "engines": results}, indent=2))
+    else:
+        for engine, result in results.items():
+            print(f"{engine:6} {result['startup_ms']:7.1f} ms startup (median run {result['median_ms']} ms, "
+                  f"max {result['max_ms']} ms, bare interpreter {result['bare_interpreter_ms']} ms), "
+                  f"budget {args.budget_ms:.0f} ms{'  OVER BUDGET' if engine in over else ''}")
+        for engine in over:
+            print()
+            print(startup_report(f"{engine}_down"))
+
+    # Going over the budget fails the benchmark, so CI notices
+    if over:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
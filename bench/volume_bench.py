@@ -0,0 +1,160 @@
+import argparse
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+# The PDF reader and writer live next to the downloaders
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'codes'))
+from pdf_reader import PdfError, PdfReader
+from pdf_writer import build_pdf, build_volume
+
+# Seconds a damaged PDF may take to be rejected before the check counts as hung
+CHECK_TIMEOUT = 10
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Check the PDF reader on damaged files and measure volume builds')
+    parser.add_argument('--chapters', type=int, help='Chapters in the measured volume', default=84)
+    parser.add_argument('--pages', type=int, help='Pages per chapter', default=12)
+    parser.add_argument('--image-size', help='Page dimensions as WIDTHxHEIGHT', default='1200x1800')
+    parser.add_argument('--json', help='Print the results as JSON', action='store_true')
+    return parser.parse_args()
+
+
+def make_jpeg(size):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 60).convert('RGB').save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+# A chapter folder with its pages and chapter.pdf
+def make_chapter(folder, jpeg, pages):
+    folder.mkdir(parents=True)
+    for index in range(pages):
+        (folder / f"{index + 1}.jpg").write_bytes(jpeg)
+    build_pdf(sorted(folder.glob("*.jpg")), folder / "chapter.pdf")
+
+
+# Ways a chapter.pdf gets damaged, each a function of the good file's bytes
+def damaged_pdfs(data):
+    startxref = data.rindex(b'startxref')
+    with_startxref = lambda offset: data[:startxref] + b'startxref\n%d\n%%%%EOF\n' % offset
+    # The %%EOF line comes right after the offset, whose digits move it
+    at_eof = startxref
+    while at_eof != startxref + len(b'startxref\n%d\n' % at_eof):
+        at_eof = startxref + len(b'startxref\n%d\n' % at_eof)
+    return {
+        "truncated": data[:len(data) // 2],
+        "startxref past the end": with_startxref(999999999),
+        "startxref at %%EOF": with_startxref(at_eof),
+        "startxref in a stream": with_startxref(len(data) // 3),
+        "no startxref": data[:startxref],
+        "not a PDF": b'<html>error</html>',
+    }
+
+
+# Run a check in a thread, so code that never returns fails the check
+# instead of hanging the benchmark. Returns the check's outcome, or "hung".
+def run_with_timeout(check):
+    outcome = ["hung"]
+
+    def run():
+        try:
+            outcome[0] = check()
+        except Exception as e:
+            outcome[0] = f"raised {type(e).__name__}: {e}"
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(CHECK_TIMEOUT)
+    return outcome[0]
+
+
+# "rejected" if the reader refuses the file with PdfError, "opened" if it reads its pages
+def open_pdf(path):
+    try:
+        with PdfReader(path) as reader:
+            reader.pages()
+    except PdfError:
+        return "rejected"
+    return "opened"
+
+
+# "rebuilt" if the volume has every page, the damaged chapter's from its images
+def build_with_damaged(good, broken, pdf_path):
+    pages, rebuilt = build_volume([good, broken], pdf_path)
+    if pages == 6 and [name for name, _ in rebuilt] == [broken.name]:
+        return "rebuilt"
+    return f"{pages} pages, rebuilt {rebuilt}"
+
+
+# Every damaged PDF has to be rejected with PdfError, and a volume with a
+# damaged chapter has to be built from that chapter's images
+def check_damaged(work_dir, jpeg):
+    good = work_dir / "good"
+    make_chapter(good, jpeg, 3)
+    data = (good / "chapter.pdf").read_bytes()
+    results = {}
+    for name, damaged in damaged_pdfs(data).items():
+        path = work_dir / "damaged.pdf"
+        path.write_bytes(damaged)
+        results[name] = run_with_timeout(lambda: open_pdf(path))
+
+    broken = work_dir / "broken"
+    make_chapter(broken, jpeg, 3)
+    (broken / "chapter.pdf").write_bytes(damaged_pdfs(data)["startxref at %%EOF"])
+    results["volume with a damaged chapter"] = run_with_timeout(
+        lambda: build_with_damaged(good, broken, work_dir / "volume.pdf"))
+    return results
+
+
+# Time a volume of every chapter, and the memory the build allocates at most
+def measure_volume(work_dir, jpeg, chapters, pages):
+    folders = [work_dir / f"Capitolo {number}" for number in range(1, chapters + 1)]
+    for folder in folders:
+        make_chapter(folder, jpeg, pages)
+    tracemalloc.start()
+    start = time.perf_counter()
+    written, rebuilt = build_volume(folders, work_dir / "volume.pdf")
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "pages": written,
+        "mb": round((work_dir / "volume.pdf").stat().st_size / 1e6, 1),
+        "seconds": round(seconds, 3),
+        "peak_python_mb": round(peak / 1e6, 2),
+        "rebuilt_chapters": len(rebuilt),
+    }
+
+
+def main():
+    args = get_args()
+    width, height = map(int, args.image_size.lower().split("x"))
+    jpeg = make_jpeg((width, height))
+    with tempfile.TemporaryDirectory(prefix="volume-bench-") as work_dir:
+        checks = check_damaged(Path(work_dir) / "checks", jpeg)
+        volume = measure_volume(Path(work_dir) / "volume", jpeg, args.chapters, args.pages)
+    failed = [name for name, outcome in checks.items() if outcome not in ("rejected", "rebuilt")]
+
+    if args.json:
+        print(json.dumps({"checks": checks, "volume": volume}, indent=2))
+    else:
+        for name, outcome in checks.items():
+            print(f"{name:32} {outcome}{'  FAILED' if name in failed else ''}")
+        print(f"volume: {volume['pages']} pages, {volume['mb']} MB in {volume['seconds']:.2f} s, "
+              f"peak {volume['peak_python_mb']} MB allocated")
+
+    # A damaged PDF that is not rejected fails the benchmark, so CI notices
+    if failed or volume["rebuilt_chapters"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,82 @@
 import os
 import asyncio
-import aiohttp
-import aiofiles
-from PIL import Image
-from bs4 import BeautifulSoup
+import contextlib
+import functools
+import itertools
+import random
+import time
 from pathlib import Path
 import argparse
+import sys
 import json
 import re
-from termcolor import colored
+from urllib.parse import urlsplit
+from manifest import Manifest
+from http_cache import HttpCache
+from metrics import Metrics
+from event_log import EventLog
+from blob_store import BlobStore, new_hasher
+from catalog import ChapterCatalog
+from memory_budget import PDF_DECODED_SUFFIXES, AsyncByteBudget, chapter_decode_bytes, download_bytes
+from startup import ProfileStartupAction
+from transcode import OUTPUT_DIR, Transcoder
+from rate_control import CONGESTION_STATUSES, AsyncAimdLimiter, RetryPolicy
+from extract import extract_chapters, extract_reader_page, extract_series_info, select_backend
+from pdf_writer import build_chapter_pdf, chapter_images
+from integrity import verify_pages
+from readiness import ReadyTracker
+
+# Settings from config/config.json, set by load_config
+config_data = None
+config_stamp = None
 
 # Load config
-config_path = Path.cwd() / 'config' / 'config.json'
-with open(config_path, 'r') as config_file:
-    config_data = json.load(config_file)
+# Called by every entry point instead of at import time. The file is only read
+# again once it changed, so a long-lived caller such as main.py picks up new
+# settings without paying for a reload on every run.
+def load_config():
+    global config_data, config_stamp, base_save_path, base_url
+    config_path = Path.cwd() / 'config' / 'config.json'
+    stamp = (config_path, config_path.stat().st_mtime_ns)
+    if stamp == config_stamp:
+        return config_data
+    with open(config_path, 'r') as config_file:
+        config_data = json.load(config_file)
+    config_stamp = stamp
+
+    # Determine base directory based on custom_save_path value
+    base_save_path = config_data.get("custom_save_path", False)
+
+    # Se custom_save_path è False, usa il percorso di base
+    if base_save_path is False:
+        base_save_path = Path.cwd() / 'Manga'
+    else:
+        base_save_path = Path(base_save_path)
 
-# Determine base directory based on custom_save_path value
-base_save_path = config_data.get("custom_save_path", False)
+    # Site the links and relative hrefs belong to; benchmarks point it at a local stand-in
+    base_url = config_data.get("base_url", "https://mangaita.io").rstrip("/")
 
-# Se custom_save_path è False, usa il percorso di base
-if base_save_path is False:
-    base_save_path = Path.cwd() / 'Manga'
-else:
-    base_save_path = Path(base_save_path)
+    select_backend(config_data.get("html_parser", "auto"))
+    return config_data
+
+# Size of the chunks streamed to disk while downloading an image
+CHUNK_SIZE = 64 * 1024
+
+# Shared limits, download manifest and post-processing pool, created by run_downloads
+limiter = None
+retry_policy = None
+chapter_semaphore = None
+manifest = None
+manifest_thread = None
+http_cache = None
+postprocess_pool = None
+metrics = None
+event_log = None
+blob_store = None
+transcoder = None
+chapter_catalog = None
+memory_budget = None
+ready_tracker = None
 
 # Create Manga folder structure if allowed
 def create_manga_folder_structure():
@@ -32,6 +86,74 @@ def create_manga_folder_structure():
         return manga_dir
     return Path.cwd()  # Default to current directory if folder creation is disabled
 
+# Page cache in the library folder, or None if disabled in the config
+def create_http_cache(library_dir):
+    if not config_data.get("http_cache", True):
+        return None
+    return HttpCache(
+        library_dir / ".cache" / "http",
+        max_bytes=config_data.get("http_cache_max_mb", 100) * 1024 * 1024,
+        ttl_seconds=config_data.get("http_cache_ttl_minutes", 30) * 60,
+    )
+
+# Content-addressed image store in the library folder, or None if disabled in the config
+def create_blob_store(library_dir):
+    if not config_data.get("blob_store", False):
+        return None
+    return BlobStore(library_dir / ".blobs", config_data.get("blob_link", "hardlink"))
+
+# Budget of image bytes held in memory at once, or None without max_inflight_mb
+def create_memory_budget():
+    max_inflight_mb = config_data.get("max_inflight_mb")
+    return AsyncByteBudget(int(max_inflight_mb * 1024 * 1024)) if max_inflight_mb else None
+
+# Hold nbytes of the memory budget while the block runs, if there is a budget
+def memory_reservation(nbytes):
+    return memory_budget.hold(nbytes) if memory_budget else contextlib.nullcontext()
+
+# Stored chapter lists of the series, refreshed once older than catalog_max_age_minutes
+def create_catalog(library_dir):
+    return ChapterCatalog(library_dir / ".cache" / "catalog", config_data.get("catalog_max_age_minutes", 60) * 60)
+
+# Device-targeted copies of the pages, or None when transcoding is off
+def create_transcoder(library_dir):
+    if not config_data.get("transcode", False):
+        return None
+    return Transcoder(library_dir / ".cache" / "transcode", config_data.get("transcode_format"),
+                      config_data.get("transcode_quality", 80), config_data.get("transcode_max_width"),
+                      config_data.get("transcode_max_height"), config_data.get("transcode_grayscale", False),
+                      config_data.get("transcode_thumbnail_size"), config_data.get("blob_link", "hardlink"))
+
+# Chapter archive in the configured package_format, or None to keep loose files only
+def create_package(chapter_dir, series, chapter_title, chapter_url):
+    package_format = config_data.get("package_format")
+    if not package_format:
+        return None
+    from chapter_package import PACKAGE_FORMATS
+    number = re.search(r'\d+(?:\.\d+)?', str(chapter_title))
+    metadata = dict(series, title=str(chapter_title), url=chapter_url, number=number.group() if number else None)
+    return PACKAGE_FORMATS[package_format](chapter_dir, metadata)
+
+# Run metrics, or None if disabled in the config
+def create_metrics():
+    if not config_data.get("metrics", False):
+        return None
+    return Metrics(
+        "async",
+        events_path=config_data.get("metrics_events"),
+        prometheus_path=config_data.get("metrics_prometheus_file"),
+        prometheus_port=config_data.get("metrics_prometheus_port"),
+    )
+
+# Writer for the download_info.txt logs, shared by every download of the run
+def create_event_log():
+    max_mb = config_data.get("log_max_mb")
+    return EventLog(
+        flush_interval=config_data.get("log_flush_seconds", 1.0),
+        max_bytes=max_mb * 1024 * 1024 if max_mb else None,
+        backup_count=config_data.get("log_backups", 3),
+    )
+
 # Create Scan folder structure if allowed
 def create_scan_folder_structure(manga_dir):
     if config_data.get("create_scan_folder", True):
@@ -43,162 +165,738 @@ def create_scan_folder_structure(manga_dir):
 # Argument parsing
 def get_args():
     parser = argparse.ArgumentParser(description='Download Manga from https://mangaita.io/')
-    parser.add_argument('-u', '--url', help='URL of the website', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-u', '--url', help='URL of the website')
+    source.add_argument('-b', '--batch', help='File with one link per line ("-" reads stdin), optionally followed by start and end chapter')
+    source.add_argument('-w', '--watch', help='Watchlist file: keep running and download new chapters of the series in it')
     parser.add_argument('-d', '--debug', help='Enable debug mode', action='store_true')
+    parser.add_argument('--profile-startup', action=ProfileStartupAction, module='async_down',
+                        help='Show how long startup takes and which imports it goes to, then exit')
     parser.add_argument('-s', '--start_chapter', type=float, help='Start chapter number', default=1)
     parser.add_argument('-e', '--end_chapter', type=float, help='End chapter number', default=None)
     return parser.parse_args()
 
+# Read batch jobs: links separated by newlines or commas, each optionally
+# followed by a start and an end chapter ("<link> [start [end]]"). An entry
+# with a chapter that is not a number is reported and skipped.
+def read_batch(batch_file):
+    if batch_file == '-':
+        content = sys.stdin.read()
+    else:
+        with open(batch_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    jobs = []
+    for number, line in enumerate(content.splitlines(), 1):
+        for entry in line.split(','):
+            fields = entry.split()
+            if not fields:
+                continue
+            try:
+                start_chapter = float(fields[1]) if len(fields) > 1 else 1
+                end_chapter = float(fields[2]) if len(fields) > 2 else None
+            except ValueError:
+                print(f"Skipping line {number} of {batch_file}, the chapter is not a number: {entry.strip()}")
+                continue
+            jobs.append((fields[0], start_chapter, end_chapter))
+    return jobs
+
+# Links must belong to the site; checked before anything of a run is set up
+def valid_series_url(url):
+    if base_url + "/" in url:
+        return True
+    print(f"Invalid URL, please use {base_url}/")
+    return False
+
 # Debug print
 def debug_print(message):
     if args.debug:
+        from termcolor import colored
         print(colored(f"Debug: {message}", 'yellow'))
 
+# Run a manifest method on the manifest's own thread. A commit waits on the
+# disk, and on other processes sharing the library for up to the manifest's
+# timeout, which must not stall the downloads on the event loop. One thread
+# keeps the writes in order, as the manifest takes one at a time anyway.
+async def manifest_call(method, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(manifest_thread, functools.partial(method, *args, **kwargs))
+
 # Download image function
-async def download_image(session, img_url, folder, download_info_file):
+# The body is streamed to a ".part" file in fixed-size chunks and only renamed
+# to its final name once it is complete and synced to disk.
+# When requests queue up, the lowest priority (chapter rank, page, image) goes first.
+async def download_image(session, img_url, folder, download_info_file, chapter_url, package=None, order=None, priority=()):
     if not img_url.startswith("http"):
-        img_url = "https://mangaita.io" + img_url  # Adjust URL if needed
+        img_url = base_url + img_url  # Adjust URL if needed
 
     img_name = os.path.basename(img_url.split("?")[0])
     img_path = folder / img_name
+    part_path = folder / (img_name + ".part")
 
-    try:
-        debug_print(f"Downloading {img_name} from {img_url}")
-        async with session.get(img_url) as response:
-            if response.status == 200:
-                async with aiofiles.open(img_path, 'wb') as f:
-                    await f.write(await response.read())
-                debug_print(f"Downloaded {img_name} to {img_path}")
-            else:
-                async with aiofiles.open(download_info_file, 'a') as df:
-                    await df.write(f"Error downloading {img_name}: {img_url}\n")
-    except Exception as e:
-        async with aiofiles.open(download_info_file, 'a') as df:
-            await df.write(f"Error downloading {img_name}: {e}\n")
-
-# Get images for a chapter
-async def get_images(session, url, folder, download_info_file):
-    async with session.get(url) as response:
-        if response.status != 200:
-            async with aiofiles.open(download_info_file, 'a') as df:
-                await df.write(f"Error fetching page: {url}\n")
-            return []
-
-        soup = BeautifulSoup(await response.text(), "html.parser")
-        img_tags = soup.find_all("img")
-
-        tasks = []
-        for img in img_tags:
-            src = img.get("src")
-            if src and "logo.2c1c1f72.webp" not in src:
-                tasks.append(download_image(session, src, folder, download_info_file))
-        await asyncio.gather(*tasks)
-
-        next_button = soup.find("a", class_="btn btn-primary btn-navigation btn-next")
-        if next_button and next_button.get("href"):
-            next_url = "https://mangaita.io" + next_button["href"]
+    if await manifest_call(manifest.image_done, img_url, img_path):
+        debug_print(f"Skipping {img_name}, already downloaded")
+        if metrics:
+            metrics.image_skipped(img_url, chapter_url)
+        if package:
+            await asyncio.to_thread(package.add_file, order, img_path)
+        return True
+
+    # An image URL already in the blob store is linked into place without downloading it again
+    if (blob_store and (digest := await manifest_call(manifest.blob_hash, img_url))
+            and await asyncio.to_thread(blob_store.link, digest, img_path)):
+        await manifest_call(manifest.record_image, img_url, chapter_url, img_path, img_path.stat().st_size, order=order)
+        debug_print(f"Linked {img_name} from the blob store")
+        if package:
+            await asyncio.to_thread(package.add_file, order, img_path)
+        if metrics:
+            metrics.image_skipped(img_url, chapter_url)
+        return True
+
+    # Retried with backoff on errors and 429/5xx, under the adaptive per-host limit
+    host = urlsplit(img_url).netloc
+    debug_print(f"Downloading {img_name} from {img_url}")
+    started, ttfb = time.perf_counter(), None
+    for attempt in itertools.count():
+        status, retry_after, error = None, None, None
+        await limiter.acquire(host, priority)
+        sent = time.perf_counter()
+        try:
+            async with session.get(img_url) as response:
+                status = response.status
+                ttfb = time.perf_counter() - sent
+                if status == 200:
+                    # The body is only read once its bytes fit in the memory budget
+                    buffered = bool(package) and not config_data.get("keep_loose_files", True)
+                    # A body shorter than the announced length is a cut download, and is retried
+                    expected_size = None if response.headers.get("Content-Encoding") else response.content_length
+                    async with memory_reservation(download_bytes(response.content_length, buffered)):
+                        if buffered:
+                            # Loose files are not kept: the image only goes into the chapter package
+                            body = await response.read()
+                            size = len(body)
+                            if expected_size is not None and size != expected_size:
+                                raise OSError(f"Got {size} of {expected_size} bytes")
+                            await asyncio.to_thread(package.add_bytes, order, img_path.suffix, body)
+                            debug_print(f"Downloaded {img_name} into {package.path}")
+                        else:
+                            size = 0
+                            hasher = new_hasher() if blob_store else None
+                            import aiofiles.os
+                            async with aiofiles.open(part_path, 'wb') as f:
+                                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                    await f.write(chunk)
+                                    size += len(chunk)
+                                    if hasher:
+                                        hasher.update(chunk)
+                                await f.flush()
+                                await asyncio.to_thread(os.fsync, f.fileno())
+                            if expected_size is not None and size != expected_size:
+                                raise OSError(f"Got {size} of {expected_size} bytes")
+                            if blob_store:
+                                await asyncio.to_thread(blob_store.add, part_path, hasher.hexdigest(), img_path)
+                                await manifest_call(manifest.record_blob, img_url, hasher.hexdigest(), size)
+                            else:
+                                await aiofiles.os.replace(part_path, img_path)
+                            await manifest_call(manifest.record_image, img_url, chapter_url, img_path, size,
+                                                response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                                expected_size, order)
+                            debug_print(f"Downloaded {img_name} to {img_path}")
+                            if package:
+                                await asyncio.to_thread(package.add_file, order, img_path)
+                        if metrics:
+                            metrics.image(img_url, chapter_url, status, ttfb, time.perf_counter() - started, size, attempt, True)
+                        return True
+                retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            error = e
+            part_path.unlink(missing_ok=True)
+        finally:
+            await limiter.release(host, congested=status in CONGESTION_STATUSES or isinstance(error, asyncio.TimeoutError))
+
+        if not retry_policy.should_retry(attempt, status, error):
+            break
+        delay = retry_policy.delay(attempt, retry_after)
+        debug_print(f"Retrying {img_name} in {delay:.1f}s after {error or f'HTTP {status}'}")
+        await asyncio.sleep(delay)
+
+    await manifest_call(manifest.fail_image, img_url, chapter_url, img_path, error or f"HTTP {status}")
+    if metrics:
+        metrics.image(img_url, chapter_url, status, ttfb, time.perf_counter() - started, 0, attempt, False)
+    if error is None:
+        event_log.write(download_info_file, f"Error downloading {img_name}: {img_url}")
+    else:
+        event_log.write(download_info_file, f"Error downloading {img_name}: {error}")
+    return False
+
+# Fetch an HTML page through the on-disk HTTP cache, returns (status, text)
+# Errors and 429/5xx answers are retried with backoff before giving up.
+# With revalidate, a cached page is always checked with the server (usually a 304).
+async def fetch_page(session, url, revalidate=False):
+    started = time.perf_counter()
+    entry = http_cache.lookup(url) if http_cache else None
+    if entry and not revalidate and http_cache.fresh(entry):
+        debug_print(f"Cache hit: {url}")
+        if metrics:
+            metrics.page(url, 200, time.perf_counter() - started, 0, "cache")
+        return 200, http_cache.load(entry)
+
+    headers = http_cache.request_headers(entry) if entry else {}
+    for attempt in itertools.count():
+        status, retry_after, error = None, None, None
+        try:
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                if status == 304 and entry:
+                    debug_print(f"Not modified, using cached page: {url}")
+                    if metrics:
+                        metrics.page(url, status, time.perf_counter() - started, attempt, "revalidated")
+                    return 200, http_cache.revalidated(entry, response.headers)
+                text = await response.text()
+                if status == 200:
+                    if metrics:
+                        metrics.page(url, status, time.perf_counter() - started, attempt, "network")
+                    if http_cache:
+                        http_cache.store(url, text, response.headers)
+                    return status, text
+                retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            error = e
+
+        if not retry_policy.should_retry(attempt, status, error):
+            break
+        delay = retry_policy.delay(attempt, retry_after)
+        debug_print(f"Retrying {url} in {delay:.1f}s after {error or f'HTTP {status}'}")
+        await asyncio.sleep(delay)
+
+    if metrics:
+        metrics.page(url, status, time.perf_counter() - started, attempt, "network")
+    if error is not None:
+        raise error
+    return status, text
+
+# Reader page crawler: walks the btn-next chain iteratively, reading the next
+# link of each page before its images are downloaded, and hands the pages to
+# get_images through the queue. A repeated URL ends the chain, and None marks
+# the end of the chapter; a page that could not be fetched is sent as (url, None).
+async def crawl_pages(session, url, queue, download_info_file):
+    seen = set()
+    while url:
+        if url in seen:
+            debug_print(f"Next page URL already visited, stopping: {url}")
+            break
+        seen.add(url)
+
+        try:
+            status, text = await fetch_page(session, url)
+            if status != 200:
+                raise ValueError(f"HTTP {status}")
+            parse_started = time.perf_counter()
+            img_srcs, next_href = extract_reader_page(text)
+            if metrics:
+                metrics.parse(url, time.perf_counter() - parse_started)
+        except Exception:
+            event_log.write(download_info_file, f"Error fetching page: {url}")
+            await queue.put((url, None))
+            break
+
+        next_url = None
+        if next_href:
+            next_url = base_url + next_href
             debug_print(f"Next page URL: {next_url}")
-            await get_images(session, next_url, folder, download_info_file)
+
+        await queue.put((url, img_srcs))  # Waits while the lookahead is full
+        url = next_url
+    await queue.put(None)
+
+# Get images for a chapter, returns True if every page and image was downloaded
+# Up to page_lookahead pages are fetched ahead of the ones whose images are still downloading.
+# Images go into the chapter package, if any, at their (page, image) position in reader order.
+async def get_images(session, url, folder, download_info_file, package=None, rank=0):
+    lookahead = max(1, config_data.get("page_lookahead", 2))
+    queue = asyncio.Queue(maxsize=1)
+    crawler = asyncio.create_task(crawl_pages(session, url, queue, download_info_file))
+
+    ok = True
+    pages_in_flight = []
+    page_number = 0
+    try:
+        while (page := await queue.get()) is not None:
+            page_url, img_srcs = page
+            if img_srcs is None:
+                ok = False
+                continue
+
+            page_number += 1
+            tasks = [download_image(session, src, folder, download_info_file, url, package, (page_number, index),
+                                    (rank, page_number, index))
+                     for index, src in enumerate(img_srcs)]
+            pages_in_flight.append(asyncio.ensure_future(asyncio.gather(*tasks)))
+            if len(pages_in_flight) > lookahead:
+                ok = all(await pages_in_flight.pop(0)) and ok
+
+        for page_images in pages_in_flight:
+            ok = all(await page_images) and ok
+    finally:
+        crawler.cancel()
+    return ok
 
 # Create PDF from images in a folder
-def create_pdf_from_images(folder):
+# The PDF is built in the post-processing pool so downloads keep running meanwhile
+async def create_pdf_from_images(folder, chapter_url):
     if not config_data.get("create_pdf", False):
         print("PDF creation is disabled in the config file.")
         return
+    if config_data.get("package_format") and not config_data.get("keep_loose_files", True):
+        print("PDF creation needs the loose image files, which keep_loose_files turns off.")
+        return
 
-    images = []
-    sorted_files = sorted(
-        folder.iterdir(),
-        key=lambda x: float(re.search(r'(\d+\.\d+|\d+)', x.name).group()) if re.search(r'(\d+\.\d+|\d+)', x.name) else float('inf')
-    )
+    pdf_path = folder / "chapter.pdf"
+    try:
+        loop = asyncio.get_running_loop()
+        decode_bytes = await asyncio.to_thread(chapter_decode_bytes, folder, PDF_DECODED_SUFFIXES) if memory_budget else 0
+        async with memory_reservation(decode_bytes):
+            started = time.perf_counter()
+            added, errors = await loop.run_in_executor(postprocess_pool, build_chapter_pdf, folder)
+    except Exception as e:
+        print(f"Error creating PDF in folder {folder}: {e}")
+        return
+    if metrics:
+        metrics.pdf(chapter_url, time.perf_counter() - started, len(added))
 
-    for file in sorted_files:
-        if file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp']:
-            try:
-                im = Image.open(file)
-                if im.mode != "RGB":
-                    im = im.convert("RGB")
-                images.append(im)
-                debug_print(f"Image {file.name} added to PDF list.")
-            except Exception as e:
-                print(f"Error processing image {file}: {e}")
-    
-    if images:
-        pdf_path = folder / "chapter.pdf"
-        try:
-            images[0].save(pdf_path, save_all=True, append_images=images[1:])
-            print(f"PDF created for chapter: {pdf_path}")
-        except Exception as e:
-            print(f"Error creating PDF in folder {folder}: {e}")
+    for name, e in errors:
+        print(f"Error processing image {folder / name}: {e}")
+    for name in added:
+        debug_print(f"Image {name} added to PDF.")
+
+    if added:
+        print(f"PDF created for chapter: {pdf_path}")
     else:
         print(f"No valid images found in folder {folder} for PDF creation.")
 
-# Download manga or chapter
-async def get_manga(args):
-    url = args.url
-    start_chapter = args.start_chapter
-    end_chapter = args.end_chapter if args.end_chapter else float('inf')  # Se end_chapter non è specificato, va fino all'ultimo capitolo
-    
-    if "https://mangaita.io/" not in url:
-        print("Invalid URL, please use https://mangaita.io/")
+# Transcode the chapter's pages for the reader devices in the post-processing pool
+async def transcode_images(folder, chapter_url):
+    if not transcoder:
+        return
+    if config_data.get("package_format") and not config_data.get("keep_loose_files", True):
+        print("Transcoding needs the loose image files, which keep_loose_files turns off.")
         return
 
-    manga_name = Path(url.split("/")[-1])
+    try:
+        loop = asyncio.get_running_loop()
+        decode_bytes = await asyncio.to_thread(chapter_decode_bytes, folder) if memory_budget else 0
+        async with memory_reservation(decode_bytes):
+            started = time.perf_counter()
+            written, cached, errors = await loop.run_in_executor(postprocess_pool, transcoder.run, folder)
+    except Exception as e:
+        print(f"Error transcoding images in folder {folder}: {e}")
+        return
+    if metrics:
+        metrics.transcode(chapter_url, time.perf_counter() - started, written, cached)
 
-    # Use the custom manga folder or the default one
-    manga_dir = create_manga_folder_structure() / manga_name
+    for name, e in errors:
+        print(f"Error transcoding image {folder / name}: {e}")
+    print(f"Transcoded images for chapter: {folder / OUTPUT_DIR} ({written} encoded, {cached} cached)")
+
+# Close the chapter archive once every page is in it
+async def finish_package(package):
+    try:
+        pages = await asyncio.to_thread(package.close)
+    except Exception as e:
+        print(f"Error creating {package.path}: {e}")
+        return
+    if pages:
+        print(f"{package.suffix[1:].upper()} created for chapter: {package.path}")
+    else:
+        print(f"No pages to package in folder {package.path.parent}.")
+
+# Download a single chapter, waiting for a free chapter slot first.
+# Chapters with a lower rank (their place in reading order) get slots and image requests first.
+# Returns True if every page was downloaded (or the chapter already had been).
+async def download_chapter(session, series_url, series, chapter_title, chapter_url, chapter_dir, download_info_path, rank=0):
+    if await manifest_call(manifest.chapter_done, chapter_url):
+        print(f"Skipping chapter: {chapter_title} (already downloaded)")
+        ready_tracker.ensure(chapter_dir, chapter_url, series_url, chapter_title)
+        return True
+
+    async with chapter_semaphore.slot((rank,)):
+        started = time.perf_counter()
+        chapter_dir.mkdir(parents=True, exist_ok=True)
+        ready_tracker.clear(chapter_dir)
+        await manifest_call(manifest.start_chapter, chapter_url, series_url, chapter_title, chapter_dir)
+
+        print(f"Processing chapter: {chapter_title}")
+        event_log.write(download_info_path, f"Processing chapter: {chapter_title}")
+        package = create_package(chapter_dir, series, chapter_title, chapter_url)
+        ok = await get_images(session, chapter_url, chapter_dir, download_info_path, package, rank)
+
+        if config_data.get("verify_downloads", False):
+            broken = await find_broken_pages(chapter_url, config_data.get("verify_full_decode", False))
+            if broken:
+                for img_url, problem in broken:
+                    print(f"Broken page {img_url}: {problem}")
+                ok = await refetch_images(session, chapter_url, chapter_dir, download_info_path,
+                                          [img_url for img_url, _ in broken]) and ok
+                ok = await pages_intact(chapter_url, config_data.get("verify_full_decode", False)) and ok
+                if package:  # It holds the broken pages, build it again from the repaired files
+                    await asyncio.to_thread(package.abort)
+                    package = await asyncio.to_thread(package_from_files, chapter_dir, series, chapter_title, chapter_url)
+
+    # Post-processing happens outside the chapter slot, so the next chapter can start downloading
+    if package:
+        await finish_package(package)
+    await asyncio.gather(create_pdf_from_images(chapter_dir, chapter_url), transcode_images(chapter_dir, chapter_url))
+    await manifest_call(manifest.finish_chapter, chapter_url, ok)
+    if ok:
+        chapter_ready(chapter_dir, chapter_url, series_url, chapter_title, download_info_path)
+    if metrics:
+        metrics.chapter(chapter_url, chapter_title, time.perf_counter() - started, ok)
+    return ok
+
+# Publish a chapter whose pages and outputs are all done: its marker file, a
+# line in download_info.txt and a metrics event
+def chapter_ready(chapter_dir, chapter_url, series_url, chapter_title, download_info_path):
+    seconds = ready_tracker.mark(chapter_dir, chapter_url, series_url, chapter_title)
+    event_log.write(download_info_path, f"Chapter ready: {chapter_title}")
+    if metrics:
+        metrics.chapter_ready(chapter_url, chapter_title, seconds)
+
+# Pages of a downloaded chapter that fail the integrity check, checked in the
+# post-processing pool: [(image url, problem)]. Pages are compared with the
+# Content-Length they were sent with, or else the size they were saved with.
+async def find_broken_pages(chapter_url, full=False):
+    pages = [(img_url, path, expected_size if expected_size is not None else size)
+             for img_url, path, size, expected_size in await manifest_call(manifest.chapter_images, chapter_url)]
+    if not pages:
+        return []
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(postprocess_pool, verify_pages, pages, full)
+
+# Check a chapter again after its broken pages were downloaded again, returns True if every page passes
+async def pages_intact(chapter_url, full=False):
+    broken = await find_broken_pages(chapter_url, full)
+    for img_url, problem in broken:
+        print(f"Still broken after downloading it again: {img_url}: {problem}")
+    return not broken
+
+# Download pages again from the site, whatever the manifest or blob store know about them.
+# A page in the blob store is usually a link to its blob, so the blob was damaged
+# with it: it is dropped from the store and the fresh download takes its place.
+# Every other page linked to the damaged blob, in any chapter, is then linked
+# to the fresh one, so the pages keep sharing one file.
+async def refetch_images(session, chapter_url, chapter_dir, download_info_path, img_urls):
+    event_log.write(download_info_path, f"Downloading {len(img_urls)} broken pages again: {chapter_url}")
+    orders = {img_url: (page, image) for img_url, _, page, image in await manifest_call(manifest.page_order, chapter_url)}
+    replaced = set()
+    for img_url in img_urls:
+        img_path = chapter_dir / os.path.basename(img_url.split("?")[0])
+        digest = await manifest_call(manifest.blob_hash, img_url)
+        if blob_store and digest:
+            await asyncio.to_thread(blob_store.discard, digest, img_path.suffix)
+            replaced.add(digest)
+        await manifest_call(manifest.forget_image, img_url, img_path)
+    results = await asyncio.gather(*(download_image(session, img_url, chapter_dir, download_info_path, chapter_url,
+                                                    order=orders.get(img_url)) for img_url in img_urls))
+    for digest in replaced:
+        for path in await manifest_call(manifest.blob_paths, digest):
+            await asyncio.to_thread(blob_store.link, digest, Path(path))
+    return all(results)
+
+# Chapter archive filled from the loose files of the chapter folder, in the
+# reader order recorded in the manifest. Chapters downloaded before the order
+# was recorded fall back to the order of the file names.
+def package_from_files(chapter_dir, series, chapter_title, chapter_url):
+    package = create_package(chapter_dir, series, chapter_title, chapter_url)
+    files = chapter_images(chapter_dir)
+    orders = {Path(path): (page, image) for _, path, page, image in manifest.page_order(chapter_url)}
+    if not all(path in orders for path in files):
+        orders = {path: (index, 0) for index, path in enumerate(files)}
+    for path in files:
+        package.add_file(orders[path], path)
+    return package
+
+# Repair a downloaded chapter: fetch its broken pages again, then rebuild the
+# package, PDF and transcoded pages that were made from them
+async def repair_chapter(session, series_url, chapter_title, chapter_url, chapter_dir, download_info_path, img_urls, full=False):
+    ready_tracker.clear(chapter_dir)
+    # Pages fixed meanwhile, by the repair of an earlier chapter linking them to the same blob, are not downloaded again
+    still_broken = {img_url for img_url, _ in await find_broken_pages(chapter_url, full)}
+    img_urls = [img_url for img_url in img_urls if img_url in still_broken]
+    ok = not img_urls or await refetch_images(session, chapter_url, chapter_dir, download_info_path, img_urls)
+    ok = await pages_intact(chapter_url, full) and ok
+    if config_data.get("package_format") and config_data.get("keep_loose_files", True):
+        catalog = await series_catalog(session, series_url)
+        package = await asyncio.to_thread(package_from_files, chapter_dir, catalog.series if catalog else {},
+                                          chapter_title, chapter_url)
+        await finish_package(package)
+    await asyncio.gather(create_pdf_from_images(chapter_dir, chapter_url), transcode_images(chapter_dir, chapter_url))
+    await manifest_call(manifest.finish_chapter, chapter_url, ok)
+    if ok:
+        chapter_ready(chapter_dir, chapter_url, series_url, chapter_title, download_info_path)
+    return ok
+
+# Folders of a series in the library: the folder its chapters go in and its download_info.txt
+def series_folders(url):
+    manga_dir = create_manga_folder_structure() / Path(url.split("/")[-1])
     scan_dir = create_scan_folder_structure(manga_dir)
-    
     manga_dir.mkdir(parents=True, exist_ok=True)
+    return scan_dir, manga_dir / 'download_info.txt'
+
+# Chapter catalog of a series: the stored one while it is fresh, otherwise the
+# series page is fetched (revalidated if refresh) and parsed again.
+# None if the page could not be fetched.
+async def series_catalog(session, url, end_chapter=None, refresh=False):
+    catalog = None if refresh else chapter_catalog.lookup(url, end_chapter)
+    if catalog:
+        debug_print(f"Using the stored chapter list of {url}")
+        return catalog
+
+    status, text = await fetch_page(session, url, revalidate=refresh)
+    if status != 200:
+        return None
+
+    parse_started = time.perf_counter()
+    listing = [(title, base_url + href) for title, href in extract_chapters(text)]
+    series = extract_series_info(text)
+    if metrics:
+        metrics.parse(url, time.perf_counter() - parse_started)
+    return chapter_catalog.store(url, series, listing)
+
+# Chapters of a series numbered from start_chapter to end_chapter, in download order.
+# Returns (series info, [(rank, chapter title, chapter url)]), or None if the page
+# could not be fetched. The rank is the chapter's place in reading order, whatever
+# latest_first says.
+async def list_chapters(session, url, start_chapter=1, end_chapter=None):
+    catalog = await series_catalog(session, url, end_chapter)
+    if catalog is None:
+        return None
+
+    selected = [(rank, Path(title), chapter_url)
+                for rank, (_, title, chapter_url) in enumerate(catalog.select(start_chapter, end_chapter))]
+    if config_data.get("latest_first", False):
+        selected.reverse()
+    return catalog.series, selected
+
+# Download manga or chapter
+async def get_manga(session, url, start_chapter=1, end_chapter=None):
+    # Use the custom manga folder or the default one
+    scan_dir, download_info_path = series_folders(url)
+    event_log.write(download_info_path, f"Download started for manga: {Path(url.split('/')[-1])}")
+
+    listing = await list_chapters(session, url, start_chapter, end_chapter)
+    if listing is None:
+        print("Failed to retrieve the webpage")
+        return
+
+    series, chapters = listing
+    tasks = [download_chapter(session, url, series, chapter_title, chapter_url, scan_dir / chapter_title, download_info_path, rank)
+             for rank, chapter_title, chapter_url in chapters]
+    debug_print(f"Scheduling {len(tasks)} chapters from {url}")
+    await asyncio.gather(*tasks)
+
+# Shared state of a run: one session, one set of limits, one post-processing
+# pool, the manifest and the writers; torn down when the run ends
+@contextlib.asynccontextmanager
+async def download_run():
+    # The HTTP client and process pool are imported here, not at startup,
+    # so runs that stop early (a bad link, -h) do not pay for them
+    import aiohttp
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from priority import PrioritySemaphore
+    global manifest, manifest_thread, http_cache, limiter, retry_policy, chapter_semaphore, postprocess_pool, metrics, event_log, blob_store, transcoder, chapter_catalog, memory_budget, ready_tracker
 
-    download_info_path = manga_dir / 'download_info.txt'
-    async with aiofiles.open(download_info_path, 'w') as df:
-        await df.write(f"Download started for manga: {manga_name}\n")
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                print("Failed to retrieve the webpage")
-                return
-
-            soup = BeautifulSoup(await response.text(), "html.parser")
-            chapter_divs = soup.find_all("div", class_="col-chapter")
-            if config_data.get("latest_first", False):
-                chapter_divs = reversed(chapter_divs)
-
-            post_index = 0
-            for chapter in chapter_divs:
-                link_tag = chapter.find("a")
-                title_tag = chapter.find("h5")
-                if link_tag and title_tag:
-                    chapter_title = Path(title_tag.text.strip().split("\n")[0])
-                    chapter_url = "https://mangaita.io" + link_tag["href"]
-
-                    # Estrai il numero del capitolo
-                    chapter_number = int(re.search(r'\d+', str(chapter_title)).group())
-
-                    # Se il capitolo è nel range specificato, scaricalo
-                    if start_chapter <= chapter_number <= end_chapter:
-                        chapter_dir = scan_dir / chapter_title
-                        chapter_dir.mkdir(parents=True, exist_ok=True)
-
-                        print(f"Processing chapter: {chapter_title}")
-                        async with aiofiles.open(download_info_path, 'a') as df:
-                            await df.write(f"Processing chapter: {chapter_title}\n")
-                        await get_images(session, chapter_url, chapter_dir, download_info_path)
-                        create_pdf_from_images(chapter_dir)
-
-                    # Se il capitolo supera l'intervallo, interrompi
-                    if chapter_number > end_chapter:
-                        break
+    # The manifest lets a rerun skip what is already on disk
+    library_dir = create_manga_folder_structure()
+    manifest = Manifest(library_dir)
+    manifest_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="manifest")
+    http_cache = create_http_cache(library_dir)
+    blob_store = create_blob_store(library_dir)
+    transcoder = create_transcoder(library_dir)
+    chapter_catalog = create_catalog(library_dir)
+    memory_budget = create_memory_budget()
+    metrics = create_metrics()
+    event_log = create_event_log()
+    ready_tracker = ReadyTracker(config_data.get("ready_markers", False))
 
+    # Image requests from every chapter share one adaptive limiter: each host's
+    # limit grows while responses are healthy and is cut on 429/502/503/504/timeouts.
+    # Both it and the chapter slots serve waiters in reading order.
+    max_connections = config_data.get("max_connections", 16)
+    max_connections_per_host = config_data.get("max_connections_per_host", 8)
+    max_concurrent_chapters = config_data.get("max_concurrent_chapters", 3)
+    limiter = AsyncAimdLimiter(max_connections, config_data.get("initial_connections_per_host", 4),
+                               max_connections_per_host, log=debug_print)
+    retry_policy = RetryPolicy(config_data.get("max_retries", 3), config_data.get("retry_base_delay", 1.0),
+                               config_data.get("retry_max_delay", 60))
+    chapter_semaphore = PrioritySemaphore(max_concurrent_chapters)
+    debug_print(f"{max_concurrent_chapters} chapters at a time, {max_connections} image connections")
+
+    connector = aiohttp.TCPConnector(
+        limit=max_connections + max_concurrent_chapters,  # Leave room for reader page requests
+        limit_per_host=max_connections_per_host + max_concurrent_chapters,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=config_data.get("request_timeout", 60),
+                                    sock_read=config_data.get("request_timeout", 60))
+    # PDFs and transcoded pages (and any other per-chapter packaging) are built in worker processes
+    postprocess_pool = ProcessPoolExecutor(max_workers=config_data.get("postprocess_workers") or None)
+
+    try:
+        with postprocess_pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                yield session
+    finally:
+        debug_print(f"Rate control final state: {limiter.describe()}")
+        if ready_tracker.count:
+            print(ready_tracker.describe())
+        if memory_budget:
+            print(f"Memory budget: {memory_budget.describe()}")
+            if metrics:
+                metrics.event("memory", peak_bytes=memory_budget.peak, budget_bytes=memory_budget.limit)
+        manifest_thread.shutdown()
+        manifest.close()
+        event_log.close()
+        close_metrics(library_dir)
+
+# Download engine: runs every (url, start_chapter, end_chapter) job concurrently
+# over one session, one set of limits and one post-processing pool
+async def run_downloads(jobs):
+    debug_print(f"Running {len(jobs)} jobs")
+    async with download_run() as session:
+        results = await asyncio.gather(
+            *(get_manga(session, url, start_chapter, end_chapter) for url, start_chapter, end_chapter in jobs),
+            return_exceptions=True,
+        )
+
+    for (url, _, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print(f"Error downloading {url}: {result}")
     print("Download finished.")
 
+# Read a watchlist: one series link per line, optionally followed by
+# interval=<minutes> and start=<chapter>; text after # is a comment.
+# Raises ValueError, naming the line, for an option that is not a number.
+def read_watchlist(watchlist_file):
+    entries = []
+    with open(watchlist_file, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            options = dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+            try:
+                interval = float(options.get("interval", config_data.get("watch_interval_minutes", 60))) * 60
+                entries.append((fields[0], interval, float(options.get("start", 1))))
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}") from None
+    return entries
+
+# Poll one watched series: its index page is always revalidated, so an
+# unchanged page costs a single 304, and only chapters that are neither
+# downloaded nor already queued are started
+async def check_series(session, url, start_chapter, queued, downloads):
+    catalog = await series_catalog(session, url, refresh=True)
+    if catalog is None:
+        print(f"Failed to check {url}")
+        return
+
+    done = await manifest_call(manifest.done_chapters, url)
+    new_chapters = [(rank, Path(title), chapter_url)
+                    for rank, (_, title, chapter_url) in enumerate(catalog.select(start_chapter))
+                    if chapter_url not in done and chapter_url not in queued]
+    if config_data.get("latest_first", False):
+        new_chapters.reverse()
+    if not new_chapters:
+        debug_print(f"No new chapters: {url}")
+        return
+
+    print(f"{len(new_chapters)} new chapters: {url}")
+    scan_dir, download_info_path = series_folders(url)
+    event_log.write(download_info_path, f"New chapters found for manga: {Path(url.split('/')[-1])}")
+
+    for rank, chapter_title, chapter_url in new_chapters:
+        queued.add(chapter_url)
+        task = asyncio.create_task(download_chapter(session, url, catalog.series, chapter_title, chapter_url,
+                                                    scan_dir / chapter_title, download_info_path, rank))
+        downloads.add(task)
+        task.add_done_callback(lambda task, chapter_url=chapter_url: (queued.discard(chapter_url), downloads.discard(task)))
+
+# Watch mode: one long-lived run that polls every series of the watchlist on its
+# own jittered interval and downloads new chapters as they are found. The
+# watchlist is read again before every round, so it can be edited while running.
+async def run_watch(watchlist_file):
+    jitter = config_data.get("watch_jitter", 0.1)
+    poll_semaphore = asyncio.Semaphore(config_data.get("watch_concurrency", 16))
+    queued, downloads = set(), set()
+    next_check = {}
+
+    async def poll(url, interval, start_chapter):
+        async with poll_semaphore:
+            try:
+                await check_series(session, url, start_chapter, queued, downloads)
+            except Exception as e:
+                print(f"Error checking {url}: {e}")
+        next_check[url] = time.monotonic() + interval * random.uniform(1 - jitter, 1 + jitter)
+
+    async with download_run() as session:
+        print(f"Watching the series in {watchlist_file}, press Ctrl+C to stop")
+        entries = []
+        while True:
+            # A watchlist being edited (or replaced by an editor's save) is read
+            # again next round; until then the series it had are still checked
+            try:
+                entries = read_watchlist(watchlist_file)
+            except (OSError, ValueError) as e:
+                print(f"Error reading {watchlist_file}, keeping the previous {len(entries)} series: {e}")
+            now = time.monotonic()
+            await asyncio.gather(*(poll(*entry) for entry in entries if next_check.get(entry[0], 0) <= now))
+
+            # Sleep until the next series is due, reading the watchlist again at least once a minute
+            due = [next_check[url] for url, _, _ in entries if url in next_check]
+            await asyncio.sleep(max(1.0, min(due + [time.monotonic() + 60]) - time.monotonic()))
+
+# Write the run's metrics summary next to the manifest
+def close_metrics(library_dir):
+    global metrics
+    if metrics:
+        summary_path = config_data.get("metrics_summary") or library_dir / "metrics.json"
+        metrics.close(summary_path)
+        metrics = None
+        print(f"Metrics written to {summary_path}")
+
+# Entry point for in-process callers such as main.py: one startup for any number of links
+def run_batch(jobs, debug=False):
+    global args
+    args = argparse.Namespace(debug=debug)
+    load_config()
+    jobs = [job for job in jobs if valid_series_url(job[0])]
+    if jobs:
+        asyncio.run(run_downloads(jobs))
+
+# Entry point of watch mode, runs until interrupted
+def run_watch_list(watchlist_file, debug=False):
+    global args
+    args = argparse.Namespace(debug=debug)
+    load_config()
+    try:
+        read_watchlist(watchlist_file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {watchlist_file}: {e}")
+        sys.exit(1)
+    try:
+        asyncio.run(run_watch(watchlist_file))
+    except KeyboardInterrupt:
+        print("Watch stopped.")
+
 # Main function
 def main():
-    global args
-    args = get_args()
-    asyncio.run(get_manga(args))
+    cli_args = get_args()
+    if cli_args.watch:
+        run_watch_list(cli_args.watch, cli_args.debug)
+        return
+    if cli_args.batch:
+        jobs = read_batch(cli_args.batch)
+    else:
+        jobs = [(cli_args.url, cli_args.start_chapter, cli_args.end_chapter)]
+    run_batch(jobs, cli_args.debug)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,86 @@
+import errno
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+LINK_MODES = ("hardlink", "reflink", "symlink", "copy")
+
+# ioctl that clones a file's extents on Btrfs/XFS (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+# Content-addressed store for downloaded images. Each distinct image is kept
+# once under .blobs/<first two hex digits>/<sha256><suffix> in the library, and
+# chapter folders get a hardlink, reflink or symlink to it (or a copy, where
+# the filesystem cannot link). The URL -> hash index lives in the manifest.
+class BlobStore:
+    def __init__(self, store_dir, link_mode="hardlink"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Unknown blob_link mode {link_mode!r}, use one of {', '.join(LINK_MODES)}")
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.link_mode = link_mode
+
+    def blob_path(self, digest, suffix):
+        return self.store_dir / digest[:2] / (digest + suffix.lower())
+
+    # Move a finished download into the store (dropping it if the blob is
+    # already there) and link it to its place in the chapter folder. A stored
+    # blob of another size was damaged on disk, and is replaced by the download.
+    def add(self, part_path, digest, dest):
+        blob = self.blob_path(digest, Path(dest).suffix)
+        if blob.exists() and blob.stat().st_size == os.path.getsize(part_path):
+            os.unlink(part_path)
+        else:
+            blob.parent.mkdir(exist_ok=True)
+            try:
+                os.replace(part_path, blob)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(part_path, blob)  # Store on another filesystem
+        self._link(blob, Path(dest))
+
+    # Take a blob out of the store, so the next download of it is stored afresh.
+    # Pages linked to it keep the old file until they are linked again.
+    def discard(self, digest, suffix):
+        self.blob_path(digest, suffix).unlink(missing_ok=True)
+
+    # Link an already stored blob to dest, returns False if the blob is gone
+    def link(self, digest, dest):
+        blob = self.blob_path(digest, Path(dest).suffix)
+        if not blob.exists():
+            return False
+        self._link(blob, Path(dest))
+        return True
+
+    # The link is made next to dest and renamed over it, so dest is never half there
+    def _link(self, blob, dest):
+        tmp = dest.with_name(dest.name + ".link")
+        tmp.unlink(missing_ok=True)
+        mode = self.link_mode
+        try:
+            if mode == "hardlink":
+                os.link(blob, tmp)
+            elif mode == "symlink":
+                os.symlink(blob.resolve(), tmp)
+            elif mode == "reflink":
+                reflink(blob, tmp)
+            else:
+                shutil.copyfile(blob, tmp)
+        except (OSError, ImportError):
+            # Another filesystem, too many links or no reflink support: fall back to a copy
+            tmp.unlink(missing_ok=True)
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, dest)
+
+
+def reflink(src, dest):
+    import fcntl
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
@@ -0,0 +1,81 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+# First number in a chapter title, decimals kept: "Capitolo 10.5" -> 10.5
+CHAPTER_NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def chapter_number(title):
+    match = CHAPTER_NUMBER.search(str(title))
+    return float(match.group().replace(',', '.')) if match else None
+
+
+# Chapters of one series sorted by number, so a chapter range is two binary
+# searches whatever order the site lists them in. Chapters whose title has
+# no number cannot be placed in a range and are left out.
+class SeriesCatalog:
+    def __init__(self, url, series, chapters, fetched_at):
+        self.url = url
+        self.series = series
+        self.fetched_at = fetched_at
+        self.chapters = sorted(chapters, key=lambda chapter: chapter[0])  # [(number, title, chapter url)]
+        self.numbers = [number for number, _, _ in self.chapters]
+
+    # Catalog of a series page's chapter list, [(title, chapter url)] in page order
+    @classmethod
+    def from_listing(cls, url, series, listing):
+        chapters = [(chapter_number(title), title, chapter_url) for title, chapter_url in listing]
+        return cls(url, series, [chapter for chapter in chapters if chapter[0] is not None], time.time())
+
+    # Chapters numbered from start_chapter to end_chapter (None: to the last one), lowest first
+    def select(self, start_chapter=1, end_chapter=None):
+        low = bisect.bisect_left(self.numbers, start_chapter)
+        high = len(self.numbers) if end_chapter is None else bisect.bisect_right(self.numbers, end_chapter)
+        return self.chapters[low:high]
+
+    def newest(self):
+        return self.numbers[-1] if self.numbers else None
+
+
+# Stored catalogs, one JSON file per series keyed by its URL. A catalog is
+# used while it is younger than max_age_seconds, unless the range asked for
+# ends past its newest chapter, which may have come out since.
+class ChapterCatalog:
+    def __init__(self, cache_dir, max_age_seconds):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+
+    def _path(self, url):
+        return self.cache_dir / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    # Fresh stored catalog for the series, or None
+    def lookup(self, url, end_chapter=None):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("url") != url or time.time() - data["fetched_at"] >= self.max_age_seconds:
+            return None
+        catalog = SeriesCatalog(url, data["series"], [tuple(chapter) for chapter in data["chapters"]], data["fetched_at"])
+        newest = catalog.newest()
+        if end_chapter is not None and (newest is None or end_chapter > newest):
+            return None
+        return catalog
+
+    # Build the catalog of a freshly parsed series page and store it
+    def store(self, url, series, listing):
+        catalog = SeriesCatalog.from_listing(url, series, listing)
+        path = self._path(url)
+        part_path = path.with_name(path.name + ".part")
+        with open(part_path, 'w', encoding='utf-8') as f:
+            json.dump({"url": url, "series": series, "fetched_at": catalog.fetched_at,
+                       "chapters": catalog.chapters}, f, ensure_ascii=False)
+        os.replace(part_path, path)
+        return catalog
@@ -0,0 +1,206 @@
+import html
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+from image_info import HEAD_SIZE, MEDIA_TYPES, image_size
+
+
+# One-file chapter archive filled while the chapter downloads. Images are
+# stored (no recompression) as they arrive, named by their (page, image)
+# position in reader order, so the archive order never depends on download
+# order or file names. The index files are written on close(); the archive
+# is built as ".part" and only renamed once complete.
+class ChapterPackage:
+    suffix = None
+
+    def __init__(self, folder, metadata):
+        self.path = Path(folder) / ("chapter" + self.suffix)
+        self.part_path = self.path.with_name(self.path.name + ".part")
+        self.metadata = metadata
+        self.lock = threading.Lock()  # The sync downloader adds pages from several threads
+        self.pages = {}  # (page, image) -> (entry name, size or None)
+        self.zip = zipfile.ZipFile(self.part_path, 'w', compression=zipfile.ZIP_STORED)
+        self.start()
+
+    def entry_name(self, order, suffix):
+        page, image = order
+        return f"{page:03d}-{image:03d}{suffix.lower()}"
+
+    # Add a downloaded image held in memory
+    def add_bytes(self, order, suffix, data):
+        name = self.entry_name(order, suffix)
+        with self.lock:
+            self.zip.writestr(self.image_entry(name), data)
+            self.pages[order] = (name, image_size(data[:HEAD_SIZE]))
+
+    # Add an image file from the chapter folder, copied into the archive in chunks
+    def add_file(self, order, path):
+        name = self.entry_name(order, Path(path).suffix)
+        with open(path, 'rb') as f:
+            size = image_size(f.read(HEAD_SIZE))
+        with self.lock:
+            self.zip.write(path, self.image_entry(name))
+            self.pages[order] = (name, size)
+
+    # Write the index files and move the archive into place, returns the number of pages
+    def close(self):
+        with self.lock:
+            pages = [self.pages[order] for order in sorted(self.pages)]
+            if not pages:
+                self.abort()
+                return 0
+            self.finish(pages)
+            self.zip.close()
+            with open(self.part_path, 'rb+') as f:
+                os.fsync(f.fileno())
+            os.replace(self.part_path, self.path)
+            return len(pages)
+
+    def abort(self):
+        self.zip.close()
+        self.part_path.unlink(missing_ok=True)
+
+    def start(self):
+        pass
+
+    def image_entry(self, name):
+        return name
+
+    def finish(self, pages):
+        raise NotImplementedError
+
+
+# Comic book archive with a ComicInfo.xml, as read by most comic readers
+class CbzPackage(ChapterPackage):
+    suffix = ".cbz"
+
+    def finish(self, pages):
+        self.zip.writestr("ComicInfo.xml", comic_info(self.metadata, pages))
+
+
+# Fixed-layout EPUB 3: one XHTML page per image, sized to the image
+class EpubPackage(ChapterPackage):
+    suffix = ".epub"
+
+    def start(self):
+        # The mimetype entry has to come first and uncompressed
+        self.zip.writestr("mimetype", "application/epub+zip")
+        self.zip.writestr("META-INF/container.xml", CONTAINER_XML)
+
+    def image_entry(self, name):
+        return "OEBPS/images/" + name
+
+    def finish(self, pages):
+        known = [size for _, size in pages if size]
+        fallback = known[0] if known else (800, 1200)
+        items, spine = [], []
+        for index, (name, size) in enumerate(pages, 1):
+            width, height = size or fallback
+            page_id = f"p{index:04d}"
+            self.zip.writestr(f"OEBPS/pages/{page_id}.xhtml", EPUB_PAGE.format(
+                title=html.escape(f"{self.metadata.get('title', '')} - {index}"), width=width, height=height, image=name))
+            cover = ' properties="cover-image"' if index == 1 else ''
+            media_type = MEDIA_TYPES.get(Path(name).suffix, "image/jpeg")
+            items.append(f'<item id="img{index:04d}" href="images/{name}" media-type="{media_type}"{cover}/>')
+            items.append(f'<item id="{page_id}" href="pages/{page_id}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="{page_id}"/>')
+
+        self.zip.writestr("OEBPS/nav.xhtml", EPUB_NAV.format(title=html.escape(book_title(self.metadata))))
+        self.zip.writestr("OEBPS/content.opf", EPUB_OPF.format(
+            identifier=html.escape(self.metadata.get("url", "")),
+            title=html.escape(book_title(self.metadata)),
+            series=html.escape(self.metadata.get("series", "")),
+            language=self.metadata.get("language", "it"),
+            modified=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            items="\n    ".join(items),
+            spine="\n    ".join(spine),
+        ))
+
+
+PACKAGE_FORMATS = {
+    "cbz": CbzPackage,
+    "epub": EpubPackage,
+}
+
+
+def book_title(metadata):
+    return " - ".join(part for part in (metadata.get("series"), metadata.get("title")) if part)
+
+
+# ComicInfo.xml (ComicRack schema) for a chapter
+def comic_info(metadata, pages):
+    root = ElementTree.Element("ComicInfo", {
+        "xmlns:xsd": "http://www.w3.org/2001/XMLSchema",
+        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+    })
+    fields = [
+        ("Title", metadata.get("title")),
+        ("Series", metadata.get("series")),
+        ("Number", metadata.get("number")),
+        ("Summary", metadata.get("summary")),
+        ("Web", metadata.get("url")),
+        ("PageCount", str(len(pages))),
+        ("LanguageISO", metadata.get("language", "it")),
+        ("Manga", "Yes"),
+    ]
+    for tag, value in fields:
+        if value:
+            ElementTree.SubElement(root, tag).text = str(value)
+
+    pages_element = ElementTree.SubElement(root, "Pages")
+    for index, (_, size) in enumerate(pages):
+        attributes = {"Image": str(index)}
+        if index == 0:
+            attributes["Type"] = "FrontCover"
+        if size:
+            attributes["ImageWidth"], attributes["ImageHeight"] = str(size[0]), str(size[1])
+        ElementTree.SubElement(pages_element, "Page", attributes)
+    return '<?xml version="1.0" encoding="utf-8"?>\n' + ElementTree.tostring(root, encoding="unicode")
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+EPUB_OPF = """<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" prefix="rendition: http://www.idpf.org/vocab/rendition/#">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">{identifier}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>{language}</dc:language>
+    <meta property="belongs-to-collection">{series}</meta>
+    <meta property="dcterms:modified">{modified}</meta>
+    <meta property="rendition:layout">pre-paginated</meta>
+    <meta property="rendition:spread">none</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    {items}
+  </manifest>
+  <spine>
+    {spine}
+  </spine>
+</package>
+"""
+
+EPUB_NAV = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{title}</title></head>
+<body><nav epub:type="toc"><ol><li><a href="pages/p0001.xhtml">{title}</a></li></ol></nav></body>
+</html>
+"""
+
+EPUB_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>{title}</title><meta name="viewport" content="width={width}, height={height}"/></head>
+<body style="margin:0"><img src="../images/{image}" alt="" style="width:{width}px;height:{height}px"/></body>
+</html>
+"""
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# Most lines taken off the queue before they are written in one go
+BATCH_SIZE = 1024
+
+# Log files kept open at once, and seconds after which an unused one is closed,
+# so a watcher following many series does not pile up open files
+MAX_OPEN_FILES = 32
+IDLE_CLOSE_SECONDS = 300
+
+
+# Single writer for the download_info.txt logs of a run. Downloads hand their
+# lines to write(), which only puts them on a queue, so neither the event loop
+# nor the download threads ever wait on the disk; one background thread
+# appends them in batches to files it keeps open, flushes every flush_interval
+# seconds, and rotates a file to .1, .2, ... once it grows past max_bytes.
+# Files idle for IDLE_CLOSE_SECONDS, or the least recently used one past
+# MAX_OPEN_FILES, are closed and opened again when a line comes for them.
+class EventLog:
+    def __init__(self, flush_interval=1.0, max_bytes=None, backup_count=3):
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = queue.SimpleQueue()
+        self.files = OrderedDict()  # path -> file, least recently written first
+        self.last_write = {}
+        self.thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self.thread.start()
+
+    # Append a line to the log at path; safe from any thread or coroutine
+    def write(self, path, line):
+        self.queue.put((path, line))
+
+    # Write out everything still queued and close the files
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+                try:
+                    self._write(*item)
+                except OSError as e:
+                    print(f"Error writing log {item[0]}: {e}")
+
+            if stopping or time.monotonic() - last_flush >= self.flush_interval:
+                for f in self.files.values():
+                    f.flush()
+                last_flush = time.monotonic()
+                self._close_idle(last_flush - IDLE_CLOSE_SECONDS)
+
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        self.last_write.clear()
+
+    def _write(self, path, line):
+        path = os.fspath(path)
+        f = self.files.get(path)
+        if f is None:
+            if len(self.files) >= MAX_OPEN_FILES:
+                self._close(next(iter(self.files)))
+            f = self.files[path] = open(path, 'a', encoding='utf-8')
+        else:
+            self.files.move_to_end(path)
+        self.last_write[path] = time.monotonic()
+        if self.max_bytes and f.tell() >= self.max_bytes:
+            f = self._rotate(path)
+        f.write(line + "\n")
+
+    # Close the files nothing was written to since the given time
+    def _close_idle(self, since):
+        for path in [path for path in self.files if self.last_write[path] < since]:
+            self._close(path)
+
+    def _close(self, path):
+        self.files.pop(path).close()
+        del self.last_write[path]
+
+    # download_info.txt -> download_info.txt.1 -> ... -> download_info.txt.<backup_count>
+    def _rotate(self, path):
+        self.files.pop(path).close()
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        f = self.files[path] = open(path, 'a', encoding='utf-8')
+        return f
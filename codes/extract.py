@@ -0,0 +1,188 @@
+# Site logo, shown on every reader page next to the scans
+LOGO_MARKER = "logo.2c1c1f72.webp"
+
+# Backends tried by "auto", fastest first
+BACKEND_ORDER = ["selectolax", "lxml", "html.parser"]
+
+# Chosen by select_backend, resolved on first use
+backend_name = "auto"
+backend = None
+
+
+# Pick the HTML parser backend: "auto", "selectolax", "lxml" or "html.parser".
+# A backend that is not installed falls back to the next one in BACKEND_ORDER.
+def select_backend(name="auto"):
+    global backend_name, backend
+    backend_name = name or "auto"
+    backend = None
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        candidates = BACKEND_ORDER if backend_name == "auto" else [backend_name] + BACKEND_ORDER
+        for name in candidates:
+            try:
+                backend = BACKENDS[name]()
+                break
+            except ImportError:
+                continue
+        else:
+            raise ImportError("No HTML parser available, install bs4, lxml or selectolax")
+    return backend
+
+
+# Where a series page keeps its title and description, as (tag, attribute, value), most specific first
+SERIES_META = {
+    "series": [("meta", "property", "og:title"), ("h1", None, None), ("title", None, None)],
+    "summary": [("meta", "property", "og:description"), ("meta", "name", "description")],
+}
+
+
+# Series metadata from the first SERIES_META location each backend's find() has a value for
+def series_info(find):
+    info = {}
+    for key, locations in SERIES_META.items():
+        for location in locations:
+            value = find(*location)
+            if value and value.strip():
+                info[key] = clean_title(value) if key == "series" else value.strip()
+                break
+    return info
+
+
+# Title as shown on the series page: the first line of the chapter heading
+def clean_title(text):
+    return text.strip().split("\n")[0]
+
+
+class SelectolaxBackend:
+    name = "selectolax"
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser as HTMLParser
+        except ImportError:  # selectolax < 0.3.13
+            from selectolax.parser import HTMLParser
+        self.parser = HTMLParser
+
+    def chapters(self, html):
+        chapters = []
+        for div in self.parser(html).css("div.col-chapter"):
+            link_tag = div.css_first("a")
+            title_tag = div.css_first("h5")
+            if link_tag and title_tag and link_tag.attributes.get("href"):
+                chapters.append((clean_title(title_tag.text()), link_tag.attributes["href"]))
+        return chapters
+
+    def series_info(self, html):
+        tree = self.parser(html)
+
+        def find(tag, attr, value):
+            node = tree.css_first(f'{tag}[{attr}="{value}"]' if attr else tag)
+            if node is None:
+                return None
+            return node.attributes.get("content") if tag == "meta" else node.text()
+        return series_info(find)
+
+    def reader_page(self, html):
+        tree = self.parser(html)
+        img_srcs = [img.attributes.get("src") for img in tree.css("img")]
+        next_button = tree.css_first("a.btn.btn-primary.btn-navigation.btn-next")
+        return img_srcs, next_button.attributes.get("href") if next_button else None
+
+
+class LxmlBackend:
+    name = "lxml"
+
+    CHAPTER_XPATH = "//div[contains(concat(' ', normalize-space(@class), ' '), ' col-chapter ')]"
+    NEXT_XPATH = "//a[@class='btn btn-primary btn-navigation btn-next']"
+
+    def __init__(self):
+        import lxml.html
+        self.fromstring = lxml.html.fromstring
+
+    def chapters(self, html):
+        chapters = []
+        for div in self.fromstring(html).xpath(self.CHAPTER_XPATH):
+            link_tag = div.find(".//a")
+            title_tag = div.find(".//h5")
+            if link_tag is not None and title_tag is not None and link_tag.get("href"):
+                chapters.append((clean_title(title_tag.text_content()), link_tag.get("href")))
+        return chapters
+
+    def series_info(self, html):
+        tree = self.fromstring(html)
+
+        def find(tag, attr, value):
+            nodes = tree.xpath(f"//{tag}[@{attr}='{value}']" if attr else f"//{tag}")
+            if not nodes:
+                return None
+            return nodes[0].get("content") if tag == "meta" else nodes[0].text_content()
+        return series_info(find)
+
+    def reader_page(self, html):
+        tree = self.fromstring(html)
+        img_srcs = tree.xpath("//img/@src")
+        next_buttons = tree.xpath(self.NEXT_XPATH)
+        return img_srcs, next_buttons[0].get("href") if next_buttons else None
+
+
+# Pure-Python fallback. Reader pages are parsed for <img> and <a> tags only;
+# a strainer does not pay off on series pages, where most of the markup is chapters.
+class HtmlParserBackend:
+    name = "html.parser"
+
+    def __init__(self):
+        from bs4 import BeautifulSoup, SoupStrainer
+        self.soup = BeautifulSoup
+        self.reader_strainer = SoupStrainer(["img", "a"])
+
+    def chapters(self, html):
+        chapters = []
+        for div in self.soup(html, "html.parser").find_all("div", class_="col-chapter"):
+            link_tag = div.find("a")
+            title_tag = div.find("h5")
+            if link_tag and title_tag and link_tag.get("href"):
+                chapters.append((clean_title(title_tag.text), link_tag["href"]))
+        return chapters
+
+    def series_info(self, html):
+        soup = self.soup(html, "html.parser")
+
+        def find(tag, attr, value):
+            node = soup.find(tag, attrs={attr: value} if attr else {})
+            if node is None:
+                return None
+            return node.get("content") if tag == "meta" else node.text
+        return series_info(find)
+
+    def reader_page(self, html):
+        soup = self.soup(html, "html.parser", parse_only=self.reader_strainer)
+        img_srcs = [img.get("src") for img in soup.find_all("img")]
+        next_button = soup.find("a", class_="btn btn-primary btn-navigation btn-next")
+        return img_srcs, next_button.get("href") if next_button else None
+
+
+BACKENDS = {
+    "selectolax": SelectolaxBackend,
+    "lxml": LxmlBackend,
+    "html.parser": HtmlParserBackend,
+}
+
+
+# (title, href) of every chapter listed on a series page, in page order
+def extract_chapters(html):
+    return get_backend().chapters(html)
+
+
+# Series title and summary from a series page, for package metadata
+def extract_series_info(html):
+    return get_backend().series_info(html)
+
+
+# Scan image sources of a reader page and the href of its next-page button (or None)
+def extract_reader_page(html):
+    img_srcs, next_href = get_backend().reader_page(html)
+    return [src for src in img_srcs if src and LOGO_MARKER not in src], next_href
+
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+# On-disk cache for HTML pages, keyed by URL. Each entry keeps the body and
+# the ETag/Last-Modified validators of the response, so a later request can
+# be made conditional and a 304 answered from disk. Pages without validators
+# are served from disk while they are younger than the TTL. The total size is
+# capped, and the least recently used entries are evicted first.
+class HttpCache:
+    def __init__(self, cache_dir, max_bytes, ttl_seconds):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()  # The sync downloader shares it between threads
+        self.total_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*.body"))
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / (key + ".json"), self.cache_dir / (key + ".body")
+
+    # Cached entry for the URL (a dict of its metadata), or None
+    def lookup(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or not body_path.exists():
+            return None
+        return entry
+
+    # True if the entry can be used without asking the server at all
+    def fresh(self, entry):
+        has_validators = entry.get("etag") or entry.get("last_modified")
+        return not has_validators and time.time() - entry["stored_at"] < self.ttl_seconds
+
+    # Headers that turn the next request for this entry into a conditional one
+    def request_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    # Body of the entry; reading it also marks it as recently used
+    def load(self, entry):
+        _, body_path = self._paths(entry["url"])
+        os.utime(body_path)
+        return body_path.read_text(encoding='utf-8')
+
+    # The server answered 304: keep the body, refresh the validators it sent back
+    def revalidated(self, entry, headers):
+        entry["etag"] = headers.get("ETag") or entry.get("etag")
+        entry["last_modified"] = headers.get("Last-Modified") or entry.get("last_modified")
+        entry["stored_at"] = time.time()
+        self._write_meta(entry)
+        return self.load(entry)
+
+    def store(self, url, text, headers):
+        meta_path, body_path = self._paths(url)
+        body = text.encode('utf-8')
+        part_path = body_path.with_name(body_path.name + ".part")
+        with open(part_path, 'wb') as f:
+            f.write(body)
+
+        with self.lock:
+            old_size = body_path.stat().st_size if body_path.exists() else 0
+            os.replace(part_path, body_path)
+            self.total_bytes += len(body) - old_size
+        self._write_meta({
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored_at": time.time(),
+        })
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def _write_meta(self, entry):
+        meta_path, _ = self._paths(entry["url"])
+        part_path = meta_path.with_name(meta_path.name + ".part")
+        with open(part_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(part_path, meta_path)
+
+    # Drop least recently used entries until the cache is back under its cap
+    def evict(self):
+        with self.lock:
+            bodies = []
+            for body_path in self.cache_dir.glob("*.body"):
+                try:
+                    stat = body_path.stat()
+                except OSError:
+                    continue
+                bodies.append((stat.st_mtime, stat.st_size, body_path))
+            bodies.sort()
+
+            self.total_bytes = sum(size for _, size, _ in bodies)
+            for _, size, body_path in bodies:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                body_path.unlink(missing_ok=True)
+                body_path.with_suffix(".json").unlink(missing_ok=True)
+                self.total_bytes -= size
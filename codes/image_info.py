@@ -0,0 +1,62 @@
+from pdf_writer import SOF_MARKERS
+
+# Bytes from the start of an image that are enough to find its size in
+# nearly every file (a large EXIF block can push a JPEG frame further)
+HEAD_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+
+# (width, height) of a JPEG, PNG, WebP or GIF from the first bytes of the
+# file, without decoding it; None if the format is unknown or cut short
+def image_size(head):
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+        return int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return int.from_bytes(head[6:8], 'little'), int.from_bytes(head[8:10], 'little')
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return webp_size(head)
+    if head[:2] == b'\xff\xd8':
+        return jpeg_size(head)
+    return None
+
+
+def webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8X' and len(head) >= 30:
+        return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+    if chunk == b'VP8 ' and len(head) >= 30 and head[23:26] == b'\x9d\x01\x2a':
+        return int.from_bytes(head[26:28], 'little') & 0x3FFF, int.from_bytes(head[28:30], 'little') & 0x3FFF
+    if chunk == b'VP8L' and len(head) >= 25 and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    return None
+
+
+def jpeg_size(head):
+    offset = 2
+    while offset + 4 <= len(head):
+        if head[offset] != 0xFF:
+            return None
+        marker = head[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        length = int.from_bytes(head[offset + 2:offset + 4], 'big')
+        if marker in SOF_MARKERS:
+            if offset + 9 > len(head):
+                return None
+            return int.from_bytes(head[offset + 7:offset + 9], 'big'), int.from_bytes(head[offset + 5:offset + 7], 'big')
+        offset += 2 + length
+    return None
@@ -0,0 +1,62 @@
+import os
+
+# Bytes read from the end of a file to find its trailer
+TAIL_SIZE = 64
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_END = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+
+# Problem with a downloaded page, or None if it looks complete. The size has
+# to match what the server announced, and the file has to start and end the
+# way its format requires, which catches truncated downloads and error pages
+# saved as images while reading only a few bytes. full also decodes it.
+def check_image(path, expected_size=None, full=False):
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            f.seek(max(0, size - TAIL_SIZE))
+            tail = f.read()
+    except OSError as e:
+        return f"unreadable ({e.strerror or e})"
+    if size == 0:
+        return "empty file"
+    if expected_size is not None and size != expected_size:
+        return f"{size} bytes, expected {expected_size}"
+
+    problem = check_structure(head, tail, size)
+    if problem or not full:
+        return problem
+    try:
+        from PIL import Image  # Only for the full check
+        with Image.open(path) as im:
+            im.load()
+    except Exception as e:
+        return f"does not decode ({e})"
+    return None
+
+
+def check_structure(head, tail, size):
+    if head[:2] == b'\xff\xd8':
+        # Some encoders pad the file after the end marker
+        return None if tail.rstrip(b'\x00\r\n ').endswith(b'\xff\xd9') else "JPEG end marker missing"
+    if head[:8] == PNG_SIGNATURE:
+        return None if tail.endswith(PNG_END) else "PNG end chunk missing"
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        riff_size = int.from_bytes(head[4:8], 'little') + 8
+        return None if size >= riff_size else f"WebP cut short ({size} of {riff_size} bytes)"
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return None if tail.rstrip(b'\x00').endswith(b'\x3b') else "GIF trailer missing"
+    return "not a JPEG, PNG, WebP or GIF image"
+
+
+# Check a list of pages, meant to run in a worker process.
+# pages is [(key, path, expected size)], returns [(key, problem)] of the broken ones.
+def verify_pages(pages, full=False):
+    broken = []
+    for key, path, expected_size in pages:
+        problem = check_image(path, expected_size, full)
+        if problem:
+            broken.append((key, problem))
+    return broken
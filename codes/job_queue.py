@@ -0,0 +1,138 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+JOBS_NAME = "jobs.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    chapter_url TEXT NOT NULL UNIQUE,
+    series_url TEXT NOT NULL,
+    title TEXT NOT NULL,
+    series_info TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+"""
+
+# Job states: queued -> leased -> done, or back to queued until attempts run out -> failed
+STATES = ("queued", "leased", "done", "failed")
+
+
+# Durable queue of chapter downloads in the library folder, shared by any
+# number of worker processes, on this machine or others that mount the same
+# library. A worker leases a job for a limited time and keeps the lease alive
+# with heartbeats; a job whose lease expires (its worker died) goes to the
+# next worker that asks. Every lease counts as an attempt, and a job that
+# used up its attempts is marked failed.
+#
+# The database uses a rollback journal rather than WAL, because WAL needs
+# shared memory that other machines cannot see.
+class JobQueue:
+    def __init__(self, library_dir, max_attempts=3):
+        self.path = Path(library_dir) / JOBS_NAME
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()  # Workers call it from helper threads
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+
+    # Run statements in one write transaction, taken up front so two workers never lease the same job
+    def _transaction(self, work):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def _execute(self, query, params=()):
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+            return cursor.rowcount, cursor.fetchall()
+
+    # Queue a chapter; a chapter that failed before is queued again. Returns True if it was (re)queued.
+    def add(self, series_url, chapter_url, title, series_info=None):
+        rowcount, _ = self._execute(
+            "INSERT INTO jobs (chapter_url, series_url, title, series_info, state, updated_at) VALUES (?, ?, ?, ?, 'queued', ?) "
+            "ON CONFLICT(chapter_url) DO UPDATE SET state = 'queued', attempts = 0, error = NULL, "
+            "series_info = excluded.series_info, updated_at = excluded.updated_at WHERE jobs.state = 'failed'",
+            (chapter_url, series_url, str(title), json.dumps(series_info or {}), time.time()),
+        )
+        return rowcount > 0
+
+    # Take the oldest job that is queued or whose lease expired, or None if there is none
+    def lease(self, worker, lease_seconds):
+        def work():
+            now = time.time()
+            while True:
+                row = self.conn.execute(
+                    "SELECT id, chapter_url, series_url, title, series_info, attempts FROM jobs "
+                    "WHERE state = 'queued' OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                job_id, chapter_url, series_url, title, series_info, attempts = row
+                if attempts >= self.max_attempts:  # Its last worker died holding it
+                    self.conn.execute("UPDATE jobs SET state = 'failed', error = 'lease expired', updated_at = ? WHERE id = ?",
+                                      (now, job_id))
+                    continue
+                self.conn.execute(
+                    "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker, now + lease_seconds, now, job_id),
+                )
+                return {
+                    "id": job_id,
+                    "chapter_url": chapter_url,
+                    "series_url": series_url,
+                    "title": title,
+                    "series_info": json.loads(series_info or "{}"),
+                    "attempt": attempts + 1,
+                }
+        return self._transaction(work)
+
+    # Extend a lease; False means it expired and the job may already be with another worker
+    def heartbeat(self, job_id, worker, lease_seconds):
+        rowcount, _ = self._execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, time.time(), job_id, worker),
+        )
+        return rowcount > 0
+
+    # Record the outcome of a leased job: done, queued for another attempt, or failed
+    def finish(self, job_id, worker, ok, error=None):
+        def work():
+            row = self.conn.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'leased'",
+                                    (job_id, worker)).fetchone()
+            if row is None:
+                return  # The lease was lost; whoever holds the job now reports it
+            state = "done" if ok else ("queued" if row[0] < self.max_attempts else "failed")
+            self.conn.execute("UPDATE jobs SET state = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                              (state, None if ok else str(error or "incomplete"), time.time(), job_id))
+        self._transaction(work)
+
+    # Number of jobs in each state
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")[1])
+        return counts
+
+    # True while some job is queued or leased, so a worker still has something to wait for
+    def pending(self):
+        return bool(self._execute("SELECT 1 FROM jobs WHERE state IN ('queued', 'leased') LIMIT 1")[1])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+from pathlib import Path
+
+import async_down as engine
+from job_queue import JobQueue
+
+# Seconds an idle worker waits before asking the queue again
+QUEUE_POLL_SECONDS = 5
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Queue chapter downloads and run workers that share them')
+    parser.add_argument('-d', '--debug', help='Enable debug mode', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='Queue the chapters of a series')
+    add.add_argument('url', help='URL of the series')
+    add.add_argument('-s', '--start_chapter', type=float, help='Start chapter number', default=1)
+    add.add_argument('-e', '--end_chapter', type=float, help='End chapter number', default=None)
+
+    work = commands.add_parser('work', help='Download queued chapters until the queue is empty')
+    work.add_argument('-p', '--processes', type=int, help='Worker processes to start on this machine', default=1)
+    work.add_argument('-f', '--follow', help='Keep waiting for new jobs instead of exiting', action='store_true')
+
+    commands.add_parser('status', help='Show how many jobs are in each state')
+    return parser.parse_args()
+
+
+# Job queue of the library folder in the config
+def open_queue():
+    return JobQueue(engine.create_manga_folder_structure(), engine.config_data.get("queue_max_attempts", 3))
+
+
+# Producer: list the chapters of a series in the range and queue one job per chapter
+async def enqueue_series(url, start_chapter, end_chapter):
+    if not engine.valid_series_url(url):
+        return
+
+    async with engine.download_run() as session:
+        listing = await engine.list_chapters(session, url, start_chapter, end_chapter)
+    if listing is None:
+        print("Failed to retrieve the webpage")
+        return
+
+    series, chapters = listing
+    jobs = open_queue()
+    added = sum(jobs.add(url, chapter_url, title, series) for _, title, chapter_url in chapters)
+    jobs.close()
+    print(f"Queued {added} of {len(chapters)} chapters from {url}")
+
+
+# Extend the lease of a job for as long as it runs
+async def keep_lease(jobs, worker, job, lease_seconds):
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        if not await asyncio.to_thread(jobs.heartbeat, job["id"], worker, lease_seconds):
+            print(f"Lost the lease on {job['chapter_url']}, another worker may download it too")
+            return
+
+
+async def run_job(session, jobs, worker, job, lease_seconds):
+    engine.debug_print(f"Leased {job['chapter_url']} (attempt {job['attempt']})")
+    heartbeat = asyncio.create_task(keep_lease(jobs, worker, job, lease_seconds))
+    ok, error = False, None
+    try:
+        scan_dir, download_info_path = engine.series_folders(job["series_url"])
+        chapter_title = Path(job["title"])
+        ok = await engine.download_chapter(session, job["series_url"], job["series_info"], chapter_title,
+                                           job["chapter_url"], scan_dir / chapter_title, download_info_path, job["id"])
+    except Exception as e:
+        error = e
+        print(f"Error downloading {job['chapter_url']}: {e}")
+    finally:
+        heartbeat.cancel()
+    await asyncio.to_thread(jobs.finish, job["id"], worker, ok, error)
+
+
+# Worker: lease chapters and download up to max_concurrent_chapters of them at a time.
+# Without follow it exits once no job is queued or leased by anyone; leases held by
+# other workers are waited for, in case they expire and have to be taken over.
+async def run_worker(follow):
+    jobs = open_queue()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    lease_seconds = engine.config_data.get("queue_lease_seconds", 300)
+    slots = asyncio.Semaphore(engine.config_data.get("max_concurrent_chapters", 3))
+    running = set()
+
+    def job_done(task):
+        running.discard(task)
+        slots.release()
+
+    async with engine.download_run() as session:
+        while True:
+            await slots.acquire()
+            job = await asyncio.to_thread(jobs.lease, worker, lease_seconds)
+            if job is None:
+                slots.release()
+                if not running and not follow and not await asyncio.to_thread(jobs.pending):
+                    break
+                await asyncio.sleep(QUEUE_POLL_SECONDS)
+                continue
+            task = asyncio.create_task(run_job(session, jobs, worker, job, lease_seconds))
+            running.add(task)
+            task.add_done_callback(job_done)
+    jobs.close()
+    print(f"Worker {worker} finished.")
+
+
+def worker_main(follow, debug):
+    engine.args = argparse.Namespace(debug=debug)
+    engine.load_config()
+    try:
+        asyncio.run(run_worker(follow))
+    except KeyboardInterrupt:
+        pass
+
+
+# Start the workers of this machine; each is a separate process with its own event loop
+def work(processes, follow, debug):
+    if processes <= 1:
+        worker_main(follow, debug)
+        return
+    workers = [multiprocessing.Process(target=worker_main, args=(follow, debug)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+def main():
+    cli_args = get_args()
+    engine.args = argparse.Namespace(debug=cli_args.debug)
+    engine.load_config()
+    if cli_args.command == 'add':
+        asyncio.run(enqueue_series(cli_args.url, cli_args.start_chapter, cli_args.end_chapter))
+    elif cli_args.command == 'work':
+        work(cli_args.processes, cli_args.follow, cli_args.debug)
+    else:
+        jobs = open_queue()
+        counts = jobs.counts()
+        jobs.close()
+        print(", ".join(f"{state}: {count}" for state, count in counts.items()))
+
+if __name__ == "__main__":
+    main()
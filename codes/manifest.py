@@ -0,0 +1,192 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    url TEXT PRIMARY KEY,
+    series_url TEXT,
+    title TEXT,
+    folder TEXT,
+    state TEXT NOT NULL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS chapters_series ON chapters (series_url);
+CREATE TABLE IF NOT EXISTS blobs (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    size INTEGER
+);
+"""
+
+# An image URL shared by several chapters (a credit page) has a row for each
+# path it was saved to
+IMAGES_TABLE = """
+CREATE TABLE IF NOT EXISTS images (
+    url TEXT NOT NULL,
+    chapter_url TEXT,
+    path TEXT NOT NULL,
+    size INTEGER,
+    expected_size INTEGER,
+    page INTEGER,
+    image INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    state TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (url, path)
+)"""
+IMAGES_INDEX = "CREATE INDEX IF NOT EXISTS images_chapter ON images (chapter_url)"
+
+
+# Persistent record of the chapters and images downloaded into a library folder.
+# A rerun asks it what is already complete and skips that work without
+# touching the network; anything failed or missing on disk is fetched again.
+#
+# Like the job queue, the database uses a rollback journal rather than WAL:
+# queue workers on other machines share the library, and WAL needs shared
+# memory they cannot see. Manifests written in WAL mode are switched over.
+# A commit can wait on those workers, so the async downloader calls the
+# manifest from a thread of its own, never from the event loop.
+class Manifest:
+    def __init__(self, library_dir):
+        self.path = Path(library_dir) / MANIFEST_NAME
+        self.lock = threading.Lock()  # The sync downloader shares it between threads
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Other processes opening the library wait until the images table is up to date
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._upgrade_images()
+            self.conn.execute(IMAGES_TABLE)
+            self.conn.execute(IMAGES_INDEX)
+
+    # Bring the images table of an older manifest up to date
+    def _upgrade_images(self):
+        table = self.conn.execute("PRAGMA table_info(images)").fetchall()
+        if not table:
+            return
+        # Manifests written before the Content-Length was recorded
+        columns = {row[1] for row in table}
+        if "expected_size" not in columns:
+            self.conn.execute("ALTER TABLE images ADD COLUMN expected_size INTEGER")
+        # ... and before the reader order of the pages was
+        if "page" not in columns:
+            self.conn.execute("ALTER TABLE images ADD COLUMN page INTEGER")
+            self.conn.execute("ALTER TABLE images ADD COLUMN image INTEGER")
+        # ... and when the table was keyed by URL alone, so chapters sharing an
+        # image overwrote each other's row: the rows move to the new table
+        if [row[1] for row in table if row[5]] == ["url"]:
+            self.conn.execute("DROP INDEX IF EXISTS images_chapter")
+            self.conn.execute("ALTER TABLE images RENAME TO images_by_url")
+            self.conn.execute(IMAGES_TABLE)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (url, chapter_url, path, size, expected_size, page, image, etag, "
+                "last_modified, state, error, updated_at) SELECT url, chapter_url, path, size, expected_size, page, "
+                "image, etag, last_modified, state, error, updated_at FROM images_by_url WHERE path IS NOT NULL"
+            )
+            self.conn.execute("DROP TABLE images_by_url")
+
+    def _execute(self, query, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(query, params).fetchall()
+
+    # True if the chapter finished in an earlier run and its folder is still there
+    def chapter_done(self, chapter_url):
+        rows = self._execute("SELECT folder FROM chapters WHERE url = ? AND state = 'done'", (chapter_url,))
+        return bool(rows) and Path(rows[0][0]).is_dir()
+
+    # URLs of the chapters of a series that finished downloading
+    def done_chapters(self, series_url):
+        rows = self._execute("SELECT url FROM chapters WHERE series_url = ? AND state = 'done'", (series_url,))
+        return {row[0] for row in rows}
+
+    def start_chapter(self, chapter_url, series_url, title, folder):
+        self._execute(
+            "INSERT INTO chapters (url, series_url, title, folder, state, updated_at) VALUES (?, ?, ?, ?, 'running', ?) "
+            "ON CONFLICT(url) DO UPDATE SET series_url = excluded.series_url, title = excluded.title, "
+            "folder = excluded.folder, state = 'running', updated_at = excluded.updated_at",
+            (chapter_url, series_url, str(title), str(folder), time.time()),
+        )
+
+    def finish_chapter(self, chapter_url, ok):
+        self._execute(
+            "UPDATE chapters SET state = ?, updated_at = ? WHERE url = ?",
+            ("done" if ok else "failed", time.time(), chapter_url),
+        )
+
+    # True if the image was completed before at this path and the file is still intact
+    def image_done(self, img_url, img_path):
+        rows = self._execute("SELECT size FROM images WHERE url = ? AND path = ? AND state = 'done'",
+                             (img_url, str(img_path)))
+        if not rows:
+            return False
+        try:
+            return Path(img_path).stat().st_size == rows[0][0]
+        except OSError:
+            return False
+
+    # expected_size is the Content-Length the server announced, if any, and
+    # order the (page, image) position of the image in reader order
+    def record_image(self, img_url, chapter_url, path, size, etag=None, last_modified=None, expected_size=None, order=None):
+        page, image = order or (None, None)
+        self._execute(
+            "INSERT OR REPLACE INTO images (url, chapter_url, path, size, expected_size, page, image, etag, last_modified, "
+            "state, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'done', NULL, ?)",
+            (img_url, chapter_url, str(path), size, expected_size, page, image, etag, last_modified, time.time()),
+        )
+
+    def fail_image(self, img_url, chapter_url, path, error):
+        self._execute(
+            "INSERT OR REPLACE INTO images (url, chapter_url, path, size, etag, last_modified, state, error, updated_at) "
+            "VALUES (?, ?, ?, NULL, NULL, NULL, 'failed', ?, ?)",
+            (img_url, chapter_url, str(path), str(error), time.time()),
+        )
+
+    # Drop what is known about an image downloaded to path, so the next download
+    # fetches it from the site again rather than skipping it or linking its blob
+    def forget_image(self, img_url, path):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM images WHERE url = ? AND path = ?", (img_url, str(path)))
+            self.conn.execute("DELETE FROM blobs WHERE url = ?", (img_url,))
+
+    # Chapters with a folder on disk, of one series or of the whole library: [(url, series url, title, folder)]
+    def chapters(self, series_url=None):
+        if series_url:
+            return self._execute("SELECT url, series_url, title, folder FROM chapters WHERE series_url = ? ORDER BY rowid",
+                                 (series_url,))
+        return self._execute("SELECT url, series_url, title, folder FROM chapters ORDER BY rowid")
+
+    # Downloaded images of a chapter: [(url, path, size, expected size)]
+    def chapter_images(self, chapter_url):
+        return self._execute("SELECT url, path, size, expected_size FROM images WHERE chapter_url = ? AND state = 'done'",
+                             (chapter_url,))
+
+    # Downloaded images of a chapter whose reader order was recorded: [(url, path, page, image)]
+    def page_order(self, chapter_url):
+        return self._execute("SELECT url, path, page, image FROM images WHERE chapter_url = ? AND state = 'done' "
+                             "AND page IS NOT NULL", (chapter_url,))
+
+    # Content hash of an image URL stored in the blob store before, or None
+    def blob_hash(self, img_url):
+        rows = self._execute("SELECT hash FROM blobs WHERE url = ?", (img_url,))
+        return rows[0][0] if rows else None
+
+    # Paths of the downloaded images whose content is the blob digest
+    def blob_paths(self, digest):
+        rows = self._execute("SELECT images.path FROM images JOIN blobs ON blobs.url = images.url "
+                             "WHERE blobs.hash = ? AND images.state = 'done'", (digest,))
+        return [row[0] for row in rows]
+
+    def record_blob(self, img_url, digest, size):
+        self._execute("INSERT OR REPLACE INTO blobs (url, hash, size) VALUES (?, ?, ?)", (img_url, digest, size))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
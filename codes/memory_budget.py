@@ -0,0 +1,112 @@
+import contextlib
+import threading
+
+from image_info import HEAD_SIZE, image_size
+from pdf_writer import chapter_images
+
+MB = 1024 * 1024
+
+# Reserved for a download that is streamed to disk: the chunk being written and the one being read
+STREAM_BYTES = 2 * 64 * 1024
+
+# Reserved for a body kept in memory when the server sends no Content-Length
+UNKNOWN_BODY_BYTES = 4 * MB
+
+# Pages a PDF build decodes; JPEGs are passed through without decoding
+PDF_DECODED_SUFFIXES = (".png", ".webp")
+
+# Decoded size per compressed byte, for a page whose dimensions cannot be read
+UNKNOWN_DECODE_RATIO = 10
+
+
+# Shared bookkeeping of the async and threaded budgets: bytes reserved by
+# everything that holds image data in memory, and the most ever reserved at
+# once. A reservation larger than the whole budget is cut to the budget, so it
+# still runs, alone.
+class ByteBudgetBase:
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self.peak = 0
+
+    def _fit(self, nbytes):
+        return min(max(int(nbytes), 0), self.limit)
+
+    def _can_take(self, nbytes):
+        return self.used + nbytes <= self.limit
+
+    def _take(self, nbytes):
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def describe(self):
+        return f"peak {self.peak / MB:.2f} MB of {self.limit / MB:.1f} MB in flight"
+
+
+class AsyncByteBudget(ByteBudgetBase):
+    def __init__(self, limit_bytes):
+        import asyncio  # Not imported at the top, the sync downloader never needs it
+        super().__init__(limit_bytes)
+        self.condition = asyncio.Condition()
+
+    # Wait until nbytes fit in the budget, hold them while the block runs
+    @contextlib.asynccontextmanager
+    async def hold(self, nbytes):
+        nbytes = self._fit(nbytes)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self._can_take(nbytes))
+            self._take(nbytes)
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.used -= nbytes
+                self.condition.notify_all()
+
+
+class ThreadByteBudget(ByteBudgetBase):
+    def __init__(self, limit_bytes):
+        super().__init__(limit_bytes)
+        self.condition = threading.Condition()
+
+    def reserve(self, nbytes):
+        nbytes = self._fit(nbytes)
+        with self.condition:
+            self.condition.wait_for(lambda: self._can_take(nbytes))
+            self._take(nbytes)
+        return nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def hold(self, nbytes):
+        nbytes = self.reserve(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+
+# Bytes a download holds in memory: the whole body if it is buffered, else the stream buffers
+def download_bytes(content_length, buffered):
+    if not buffered:
+        return STREAM_BYTES
+    return content_length if content_length is not None else UNKNOWN_BODY_BYTES
+
+
+# Bytes held while the largest page of a chapter is decoded and converted
+# (the bitmap and its converted copy, 4 bytes a pixel at most). Pages are
+# decoded one at a time, so that is what a PDF build or transcode needs.
+# Only pages with one of the suffixes are counted, if given.
+def chapter_decode_bytes(folder, suffixes=None):
+    largest = 0
+    for path in chapter_images(folder):
+        if suffixes and path.suffix.lower() not in suffixes:
+            continue
+        with open(path, 'rb') as f:
+            size = image_size(f.read(HEAD_SIZE))
+        largest = max(largest, 2 * 4 * size[0] * size[1] if size else UNKNOWN_DECODE_RATIO * path.stat().st_size)
+    return largest
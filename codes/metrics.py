@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+
+# Prefix of every metric in the Prometheus output
+PREFIX = "mangaita"
+
+# Bucket upper bounds: seconds for timings, bytes for sizes
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+HISTOGRAMS = {
+    "image_ttfb_seconds": TIME_BUCKETS,
+    "image_latency_seconds": TIME_BUCKETS,
+    "image_bytes": SIZE_BUCKETS,
+    "page_latency_seconds": TIME_BUCKETS,
+    "parse_seconds": TIME_BUCKETS,
+    "pdf_seconds": TIME_BUCKETS,
+    "transcode_seconds": TIME_BUCKETS,
+    "chapter_seconds": TIME_BUCKETS,
+}
+
+
+# Fixed-bucket histogram; percentiles are interpolated linearly within the
+# bucket they fall in, as Prometheus' histogram_quantile does, and never
+# reported above the largest value seen
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen, lower = 0, 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            if count and seen + count >= rank:
+                return round(min(lower + (bound - lower) * (rank - seen) / count, self.max), 6)
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6),
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "max": round(self.max, 6),
+        }
+
+
+# Counters, histograms and per-chapter totals of one download run, plus an
+# optional JSONL stream of every image, page and chapter event. The downloaders
+# keep the instance in their `metrics` global and leave it None when disabled,
+# so a run without metrics only pays for the `if metrics` checks.
+class Metrics:
+    def __init__(self, engine, events_path=None, prometheus_path=None, prometheus_port=None, prometheus_interval=15):
+        self.engine = engine
+        self.lock = threading.Lock()  # The sync downloader records from several threads
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {name: Histogram(bounds) for name, bounds in HISTOGRAMS.items()}
+        self.chapters = {}
+        self.first_ready_seconds = None
+        self.events = open(events_path, 'a', encoding='utf-8') if events_path else None
+        self.prometheus_path = prometheus_path
+        self.stop = threading.Event()
+        self.threads = []
+
+        if prometheus_path:
+            self._background(self._write_prometheus_loop, prometheus_interval)
+        self.server = None
+        if prometheus_port:
+            from http.server import ThreadingHTTPServer
+            self.server = ThreadingHTTPServer(("0.0.0.0", prometheus_port), make_handler(self))
+            self._background(self.server.serve_forever)
+
+    def _background(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def event(self, kind, **fields):
+        if self.events:
+            line = json.dumps({"ts": round(time.time(), 6), "event": kind, **fields})
+            with self.lock:
+                if self.events:
+                    self.events.write(line + "\n")
+
+    def _chapter(self, chapter_url):
+        if chapter_url not in self.chapters:
+            self.chapters[chapter_url] = {"images": 0, "failed": 0, "skipped": 0, "bytes": 0, "retries": 0}
+        return self.chapters[chapter_url]
+
+    # A finished image download: ttfb is None if no response ever arrived
+    def image(self, url, chapter_url, status, ttfb, latency, size, retries, ok):
+        with self.lock:
+            if ttfb is not None:
+                self.histograms["image_ttfb_seconds"].observe(ttfb)
+            self.histograms["image_latency_seconds"].observe(latency)
+            if ok:
+                self.histograms["image_bytes"].observe(size)
+            chapter = self._chapter(chapter_url)
+            chapter["images" if ok else "failed"] += 1
+            chapter["bytes"] += size
+            chapter["retries"] += retries
+        self.count("images_total", status=str(status or "error"))
+        self.count("image_bytes_total", size)
+        if retries:
+            self.count("image_retries_total", retries)
+        self.event("image", url=url, chapter=chapter_url, status=status, ttfb=ttfb, latency=round(latency, 6),
+                   bytes=size, retries=retries, ok=ok)
+
+    def image_skipped(self, url, chapter_url):
+        with self.lock:
+            self._chapter(chapter_url)["skipped"] += 1
+        self.count("images_skipped_total")
+        self.event("image_skipped", url=url, chapter=chapter_url)
+
+    # An HTML page request; source is "network", "cache" or "revalidated"
+    def page(self, url, status, latency, retries, source):
+        self.observe("page_latency_seconds", latency)
+        self.count("pages_total", source=source, status=str(status or "error"))
+        if retries:
+            self.count("page_retries_total", retries)
+        self.event("page", url=url, status=status, latency=round(latency, 6), retries=retries, source=source)
+
+    def parse(self, url, seconds):
+        self.observe("parse_seconds", seconds)
+        self.event("parse", url=url, seconds=round(seconds, 6))
+
+    def pdf(self, chapter_url, seconds, pages):
+        self.observe("pdf_seconds", seconds)
+        with self.lock:
+            self._chapter(chapter_url)["pdf_seconds"] = round(seconds, 6)
+        self.event("pdf", chapter=chapter_url, seconds=round(seconds, 6), pages=pages)
+
+    def transcode(self, chapter_url, seconds, written, cached):
+        self.observe("transcode_seconds", seconds)
+        self.count("transcoded_images_total", written)
+        self.count("transcode_cache_hits_total", cached)
+        with self.lock:
+            self._chapter(chapter_url)["transcode_seconds"] = round(seconds, 6)
+        self.event("transcode", chapter=chapter_url, seconds=round(seconds, 6), written=written, cached=cached)
+
+    def chapter(self, chapter_url, title, seconds, ok):
+        self.observe("chapter_seconds", seconds)
+        self.count("chapters_total", ok=str(ok).lower())
+        with self.lock:
+            chapter = self._chapter(chapter_url)
+            chapter.update(title=str(title), seconds=round(seconds, 6), ok=ok)
+        self.event("chapter", chapter=chapter_url, **chapter)
+
+    # A chapter became readable, seconds after the run started
+    def chapter_ready(self, chapter_url, title, seconds):
+        self.count("chapters_ready_total")
+        with self.lock:
+            if self.first_ready_seconds is None:
+                self.first_ready_seconds = round(seconds, 6)
+        self.event("chapter_ready", chapter=chapter_url, title=str(title), seconds=round(seconds, 6))
+
+    def summary(self):
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label = ",".join(f"{key}={text}" for key, text in labels)
+                counters[f"{name}{{{label}}}" if label else name] = value
+            return {
+                "engine": self.engine,
+                "started": self.started,
+                "seconds": round(time.time() - self.started, 3),
+                "first_ready_seconds": self.first_ready_seconds,
+                "counters": counters,
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                "chapters": dict(self.chapters),
+            }
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {PREFIX}_{name} counter")
+                    seen.add(name)
+                label = ",".join(f'{key}="{text}"' for key, text in labels)
+                lines.append(f"{PREFIX}_{name}{{{label}}} {value}" if label else f"{PREFIX}_{name} {value}")
+            for name, histogram in self.histograms.items():
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{PREFIX}_{name}_sum {histogram.sum}")
+                lines.append(f"{PREFIX}_{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        part_path = f"{self.prometheus_path}.part"
+        with open(part_path, 'w') as f:
+            f.write(self.prometheus())
+        # Replaced atomically, so a node_exporter textfile collector never reads half a file
+        os.replace(part_path, self.prometheus_path)
+
+    def _write_prometheus_loop(self, interval):
+        while not self.stop.wait(interval):
+            self.write_prometheus()
+
+    # Write the JSON summary, flush the last Prometheus file and stop the background threads
+    def close(self, summary_path=None):
+        self.stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.prometheus_path:
+            self.write_prometheus()
+        with self.lock:
+            if self.events:
+                self.events.close()
+                self.events = None
+        summary = self.summary()
+        if summary_path:
+            with open(summary_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+        return summary
+
+
+def make_handler(metrics):
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    return MetricsHandler
@@ -0,0 +1,331 @@
+import re
+from collections import namedtuple
+
+# Reads the page objects of an existing PDF so they can be copied into
+# another one without decoding anything. Only classic cross-reference tables
+# are supported, which is what PdfWriter and Pillow write; PDFs with
+# cross-reference streams, object streams or encryption raise PdfError.
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+
+# Page attributes a page inherits from the page tree nodes above it
+INHERITED = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+# Bytes read at a time when an object or the end of the file is parsed
+READ_SIZE = 4096
+
+NUMBER = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)$')
+
+Ref = namedtuple("Ref", "num gen")
+
+
+class PdfError(ValueError):
+    pass
+
+
+# More bytes are needed to finish parsing
+class Incomplete(Exception):
+    pass
+
+
+# Values: dict (name -> value), list, Ref, Name, bytes for strings and
+# Token for numbers, true, false and null
+class Name(str):
+    pass
+
+
+class Token(str):
+    pass
+
+
+class Parser:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip_space(self):
+        data = self.data
+        while self.pos < len(data):
+            char = data[self.pos]
+            if char in WHITESPACE:
+                self.pos += 1
+            elif char == 0x25:  # % comment, to the end of the line
+                while self.pos < len(data) and data[self.pos] not in b'\r\n':
+                    self.pos += 1
+            else:
+                return
+        raise Incomplete()
+
+    def regular(self):
+        start = self.pos
+        while self.pos < len(self.data) and self.data[self.pos] not in WHITESPACE + DELIMITERS:
+            self.pos += 1
+        if self.pos == len(self.data):
+            raise Incomplete()
+        return self.data[start:self.pos]
+
+    def keyword(self):
+        self.skip_space()
+        return self.regular()
+
+    def value(self):
+        self.skip_space()
+        data, pos = self.data, self.pos
+        if data.startswith(b'<<', pos):
+            self.pos += 2
+            result = {}
+            while True:
+                self.skip_space()
+                if self.data.startswith(b'>>', self.pos):
+                    self.pos += 2
+                    return result
+                key = self.value()
+                if not isinstance(key, Name):
+                    raise PdfError(f"Dictionary key is not a name at byte {self.pos}")
+                result[key] = self.value()
+        if data[pos] == 0x5B:  # [
+            self.pos += 1
+            result = []
+            while True:
+                self.skip_space()
+                if self.data[self.pos] == 0x5D:  # ]
+                    self.pos += 1
+                    return result
+                result.append(self.value())
+        if data[pos] == 0x2F:  # /
+            self.pos += 1
+            return Name("/" + decode_name(self.regular()))
+        if data[pos] == 0x28:  # (
+            return self.literal_string()
+        if data[pos] == 0x3C:  # <
+            end = data.find(b'>', pos)
+            if end < 0:
+                raise Incomplete()
+            self.pos = end + 1
+            digits = bytes(c for c in data[pos + 1:end] if c not in WHITESPACE)
+            return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode())
+        token = self.regular()
+        if not token:
+            raise PdfError(f"Unexpected byte {data[pos:pos + 1]!r} at byte {pos}")
+        if token.isdigit():
+            # "num gen R" is a reference, otherwise it is just a number
+            after = self.pos
+            gen = self.keyword()
+            if gen.isdigit() and self.keyword() == b'R':
+                return Ref(int(token), int(gen))
+            self.pos = after
+        if not NUMBER.match(token) and token not in (b'true', b'false', b'null'):
+            raise PdfError(f"Unexpected token {token[:20]!r} at byte {pos}")
+        return Token(token.decode())
+
+    def literal_string(self):
+        data = self.data
+        depth, pos, out = 0, self.pos, bytearray()
+        escapes = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f'}
+        while True:
+            if pos >= len(data):
+                raise Incomplete()
+            char = data[pos]
+            if char == 0x5C:  # Backslash
+                pos += 1
+                if pos >= len(data):
+                    raise Incomplete()
+                char = data[pos]
+                if char in escapes:
+                    out += escapes[char]
+                elif 0x30 <= char <= 0x37:  # Octal, up to three digits
+                    end = pos
+                    while end < pos + 3 and end < len(data) and 0x30 <= data[end] <= 0x37:
+                        end += 1
+                    out.append(int(data[pos:end], 8) & 0xFF)
+                    pos = end - 1
+                elif char == 0x0D:  # Escaped end of line: the string goes on
+                    if data[pos + 1:pos + 2] == b'\n':
+                        pos += 1
+                elif char != 0x0A:
+                    out.append(char)
+            elif char == 0x28:
+                if depth:
+                    out.append(char)
+                depth += 1
+            elif char == 0x29:
+                depth -= 1
+                if not depth:
+                    self.pos = pos + 1
+                    return bytes(out)
+                out.append(char)
+            else:
+                out.append(char)
+            pos += 1
+
+
+def decode_name(raw):
+    return re.sub(rb'#([0-9A-Fa-f]{2})', lambda match: bytes([int(match.group(1), 16)]), raw).decode('latin-1')
+
+
+# PDF syntax of a value, as ASCII text; references go through map_ref
+def serialize(value, map_ref):
+    if isinstance(value, Ref):
+        return f"{map_ref(value)} 0 R"
+    if isinstance(value, Name):
+        return "/" + "".join(char if 0x21 <= ord(char) <= 0x7E and char not in "()<>[]{}/%#" else f"#{ord(char):02X}"
+                             for char in value[1:])
+    if isinstance(value, dict):
+        return "<< " + " ".join(f"{serialize(key, map_ref)} {serialize(item, map_ref)}" for key, item in value.items()) + " >>"
+    if isinstance(value, list):
+        return "[" + " ".join(serialize(item, map_ref) for item in value) + "]"
+    if isinstance(value, bytes):
+        return "<" + value.hex() + ">"
+    return str(value)
+
+
+# Reads bytes of a stream straight from the source file, as shutil.copyfileobj expects
+class StreamSlice:
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.left = length
+
+    def read(self, size=-1):
+        if self.left <= 0:
+            return b''
+        size = self.left if size is None or size < 0 else min(size, self.left)
+        self.file.seek(self.offset)
+        data = self.file.read(size)
+        if len(data) < size:
+            raise PdfError("Stream runs past the end of the file")
+        self.offset += len(data)
+        self.left -= len(data)
+        return data
+
+
+# An open PDF: its cross-reference table, read once, and objects parsed on
+# demand. Stream data is never loaded; streams are returned as (dictionary,
+# StreamSlice) for the caller to copy.
+class PdfReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.offsets = {}
+            self.trailer = {}
+            self._read_xref(self._startxref())
+        except BaseException:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def _startxref(self):
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        self.file.seek(max(0, size - 1024))
+        tail = self.file.read()
+        index = tail.rfind(b'startxref')
+        offset = tail[index + 9:].split()[:1] if index >= 0 else []
+        if not offset or not offset[0].isdigit():
+            raise PdfError("No startxref, the file is truncated or not a PDF")
+        if int(offset[0]) >= size:
+            raise PdfError(f"startxref {int(offset[0])} is past the end of the file")
+        return int(offset[0])
+
+    # Read a cross-reference section and the ones before it (/Prev), later entries winning
+    def _read_xref(self, offset):
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            parser = self._parser_at(offset)
+            while True:
+                try:
+                    if parser.keyword() != b'xref':
+                        raise PdfError("Cross-reference streams are not supported")
+                    sections = []
+                    while (token := parser.keyword()) != b'trailer':
+                        start, count = int(token), int(parser.keyword())
+                        parser.skip_space()
+                        sections.append((start, count, parser.pos))
+                        parser.pos += count * 20
+                    trailer = parser.value()
+                    break
+                except Incomplete:
+                    size = len(parser.data)
+                    parser = self._parser_at(offset, size * 4)
+                    if len(parser.data) <= size:
+                        raise PdfError(f"Cross-reference section at byte {offset} runs past the end of the file")
+            for start, count, pos in sections:
+                for index in range(count):
+                    entry = parser.data[pos + index * 20:pos + index * 20 + 18].split()
+                    if len(entry) == 3:  # Free entries hide the object from older sections
+                        self.offsets.setdefault(start + index, int(entry[0]) if entry[2] == b'n' else None)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            if "/XRefStm" in trailer or "/Encrypt" in trailer:
+                raise PdfError("Hybrid or encrypted PDFs are not supported")
+            offset = int(trailer["/Prev"]) if "/Prev" in trailer else None
+
+    def _parser_at(self, offset, size=READ_SIZE):
+        self.file.seek(offset)
+        return Parser(self.file.read(size))
+
+    # Value of an indirect object, or (dictionary, StreamSlice) for a stream
+    def get(self, ref):
+        offset = self.offsets.get(ref.num)
+        if offset is None:
+            return Token("null")
+        size = READ_SIZE
+        while True:
+            parser = self._parser_at(offset, size)
+            try:
+                if not parser.keyword().isdigit() or not parser.keyword().isdigit() or parser.keyword() != b'obj':
+                    raise PdfError(f"Object {ref.num} is not at its cross-reference offset")
+                value = parser.value()
+                parser.skip_space()
+                is_stream = parser.data.startswith(b'stream', parser.pos)
+                break
+            except Incomplete:
+                if len(parser.data) < size:
+                    raise PdfError(f"Object {ref.num} runs past the end of the file")
+                size *= 4
+        if not is_stream:
+            return value
+
+        pos = parser.pos + len(b'stream')
+        pos += 2 if parser.data.startswith(b'\r\n', pos) else 1
+        length = value.get("/Length")
+        if isinstance(length, Ref):
+            length = self.get(length)
+        return value, StreamSlice(self.file, offset + pos, int(length))
+
+    def resolve(self, value):
+        return self.get(value) if isinstance(value, Ref) else value
+
+    # [(page reference, attributes inherited from the page tree)], in page order.
+    # Every node of the tree, pages included, is kept in page_tree.
+    def pages(self):
+        catalog = self.resolve(self.trailer.get("/Root"))
+        if not isinstance(catalog, dict) or "/Pages" not in catalog:
+            raise PdfError("No page tree")
+        pages = []
+        stack = [(catalog["/Pages"], {}, 0)]
+        seen = set()
+        while stack:
+            node_ref, inherited, depth = stack.pop()
+            if node_ref in seen or depth > 64:
+                raise PdfError("Page tree loops")
+            seen.add(node_ref)
+            node = self.resolve(node_ref)
+            if node.get("/Type") == "/Pages" or "/Kids" in node:
+                inherited = dict(inherited, **{key: node[key] for key in INHERITED if key in node})
+                # Pushed in reverse so they come off the stack in order
+                stack.extend((kid, inherited, depth + 1) for kid in reversed(self.resolve(node["/Kids"])))
+            else:
+                pages.append((node_ref, inherited))
+        self.page_tree = seen
+        return pages
@@ -0,0 +1,298 @@
+import os
+import re
+import shutil
+from io import BytesIO
+from pathlib import Path
+
+from pdf_reader import PdfReader, Token, serialize
+
+IMAGE_SUFFIXES = ['.jpg', '.jpeg', '.png', '.webp']
+
+# Quality used when a non-JPEG page has to be re-encoded for the PDF
+JPEG_QUALITY = 90
+
+# JPEG start-of-frame markers, they carry the image size and component count
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+
+# Page tree of every PdfWriter file
+PAGES_REF = Token("2 0 R")
+
+
+# Page images of a chapter folder, sorted by the number in their file name
+def chapter_images(folder):
+    number = re.compile(r'(\d+\.\d+|\d+)')
+    files = [f for f in Path(folder).iterdir() if f.suffix.lower() in IMAGE_SUFFIXES]
+    return sorted(files, key=lambda x: float(number.search(x.name).group()) if number.search(x.name) else float('inf'))
+
+
+# Read width, height and colour layout of a JPEG from its headers.
+# Returns None if the file is not a JPEG a PDF can embed as-is.
+def jpeg_info(path):
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        adobe = False
+        while True:
+            byte = f.read(1)
+            while byte == b'\xff':  # Skip fill bytes before the marker code
+                byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                continue
+            if marker == 0xD9 or marker == 0xDA:  # End of image or start of scan before any frame
+                return None
+            length_bytes = f.read(2)
+            if len(length_bytes) != 2:
+                return None
+            length = int.from_bytes(length_bytes, 'big')
+            segment = f.read(length - 2)
+            if marker == 0xEE and segment.startswith(b'Adobe'):
+                adobe = True
+            elif marker in SOF_MARKERS:
+                precision = segment[0]
+                height = int.from_bytes(segment[1:3], 'big')
+                width = int.from_bytes(segment[3:5], 'big')
+                components = segment[5]
+                if precision != 8 or components not in COLOR_SPACES or not width or not height:
+                    return None
+                return width, height, components, adobe
+
+
+# Text as a PDF string any reader shows correctly, for bookmark titles
+def text_string(text):
+    try:
+        data = text.encode('ascii')
+    except UnicodeEncodeError:
+        data = b'\xfe\xff' + text.encode('utf-16-be')
+    return "<" + data.hex() + ">"
+
+
+# Incremental PDF builder: every page is written to disk as soon as it is
+# added, JPEG files are embedded untouched (DCTDecode passthrough) and other
+# formats are decoded one at a time, so memory stays at about one page.
+# Pages of other PDFs are copied object by object, streams byte for byte.
+class PdfWriter:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.part_path = self.path.with_name(self.path.name + ".part")
+        self.file = open(self.part_path, 'wb')
+        self.offsets = {}
+        self.page_ids = []
+        self.bookmarks = []  # (title, index of the first page)
+        self.next_id = 3  # 1 is the catalog, 2 the page tree
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _write_stream(self, obj_id, dictionary, length, source):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n<< {dictionary} /Length {length} >>\nstream\n".encode())
+        if isinstance(source, bytes):
+            self.file.write(source)
+        else:
+            shutil.copyfileobj(source, self.file)
+        self.file.write(b"\nendstream\nendobj\n")
+
+    def _add_page(self, width, height, image_dictionary, length, source):
+        image_id, content_id, page_id = self._new_id(), self._new_id(), self._new_id()
+        self._write_stream(
+            image_id,
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/BitsPerComponent 8 /Filter /DCTDecode {image_dictionary}",
+            length, source,
+        )
+        content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        self._write_stream(content_id, "", len(content), content)
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        self.page_ids.append(page_id)
+
+    # Add one page, passing JPEG data through and re-encoding anything else
+    def add_image(self, path):
+        info = jpeg_info(path)
+        if info:
+            width, height, components, adobe = info
+            image_dictionary = f"/ColorSpace {COLOR_SPACES[components]}"
+            if components == 4 and adobe:
+                image_dictionary += " /Decode [1 0 1 0 1 0 1 0]"  # Adobe CMYK JPEGs are stored inverted
+            with open(path, 'rb') as source:
+                self._add_page(width, height, image_dictionary, os.path.getsize(path), source)
+            return
+
+        from PIL import Image  # Only needed for pages that are not plain JPEG
+
+        buffer = BytesIO()
+        with Image.open(path) as im:
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            width, height = im.size
+            im.save(buffer, "JPEG", quality=JPEG_QUALITY)
+        data = buffer.getvalue()
+        self._add_page(width, height, "/ColorSpace /DeviceRGB", len(data), data)
+
+    # Copy every page of an open PdfReader with the objects it uses (images,
+    # fonts, content streams); nothing is decoded. Returns the pages copied.
+    # If the source turns out to be broken, the pages copied so far are left
+    # out and the exception is raised.
+    def add_pdf(self, reader):
+        pages = reader.pages()
+        first_id, first_page = self.next_id, len(self.page_ids)
+        # Pages keep the numbers given here, and references to the source's
+        # page tree point to this one, so nothing else of the tree is copied
+        ids = {node: 2 for node in reader.page_tree}
+        ids.update((page_ref, self._new_id()) for page_ref, _ in pages)
+        pending = []
+
+        def map_ref(ref):
+            if ref not in ids:
+                ids[ref] = self._new_id()
+                pending.append(ref)
+            return ids[ref]
+
+        try:
+            for page_ref, inherited in pages:
+                page = dict(inherited, **reader.get(page_ref))
+                page["/Parent"] = PAGES_REF
+                self._write_object(ids[page_ref], serialize(page, map_ref).encode())
+                self.page_ids.append(ids[page_ref])
+                while pending:
+                    ref = pending.pop()
+                    value = reader.get(ref)
+                    if isinstance(value, tuple):
+                        dictionary, data = value
+                        dictionary = {key: item for key, item in dictionary.items() if key != "/Length"}
+                        self._write_stream(ids[ref], serialize(dictionary, map_ref)[3:-3], data.left, data)
+                    else:
+                        self._write_object(ids[ref], serialize(value, map_ref).encode())
+        except BaseException:
+            # Whatever was written of this source becomes unused null objects
+            del self.page_ids[first_page:]
+            for obj_id in range(first_id, self.next_id):
+                self._write_object(obj_id, b"null")
+            raise
+        return len(pages)
+
+    # The next page added starts a bookmark
+    def add_bookmark(self, title):
+        self.bookmarks.append((title, len(self.page_ids)))
+
+    # Flat outline of the bookmarks that have a page, returns its object number
+    def _write_outline(self):
+        marks = [(title, self.page_ids[index]) for title, index in self.bookmarks if index < len(self.page_ids)]
+        outline_id = self._new_id()
+        item_ids = [self._new_id() for _ in marks]
+        for position, (title, page_id) in enumerate(marks):
+            links = ""
+            if position:
+                links += f" /Prev {item_ids[position - 1]} 0 R"
+            if position + 1 < len(marks):
+                links += f" /Next {item_ids[position + 1]} 0 R"
+            self._write_object(item_ids[position], (
+                f"<< /Title {text_string(title)} /Parent {outline_id} 0 R /Dest [{page_id} 0 R /Fit]{links} >>"
+            ).encode())
+        if item_ids:
+            self._write_object(outline_id, (
+                f"<< /Type /Outlines /First {item_ids[0]} 0 R /Last {item_ids[-1]} 0 R /Count {len(item_ids)} >>"
+            ).encode())
+        else:
+            self._write_object(outline_id, b"<< /Type /Outlines /Count 0 >>")
+        return outline_id
+
+    def close(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        if self.bookmarks:
+            self._write_object(1, f"<< /Type /Catalog /Pages 2 0 R /Outlines {self._write_outline()} 0 R "
+                                  f"/PageMode /UseOutlines >>".encode())
+        else:
+            self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, self.next_id):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode())
+        self.file.write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        self.part_path.unlink(missing_ok=True)
+
+
+# Write the given images to a PDF, one page each.
+# Returns the pages added and the (file, error) pairs of pages that were skipped.
+def build_pdf(image_files, pdf_path):
+    added, errors = [], []
+    pdf = PdfWriter(pdf_path)
+    try:
+        for file in image_files:
+            try:
+                pdf.add_image(file)
+                added.append(file)
+            except Exception as e:
+                errors.append((file, e))
+    except BaseException:
+        pdf.abort()
+        raise
+
+    if added:
+        pdf.close()
+    else:
+        pdf.abort()
+    return added, errors
+
+
+# Merge chapters into one PDF, a bookmark each. The pages of chapter.pdf are
+# copied as they are; a chapter whose PDF is missing or cannot be read is
+# added from its images instead. Returns the pages written and the
+# (chapter, error) pairs of the chapters that were added from their images.
+def build_volume(chapter_dirs, pdf_path):
+    pages, rebuilt = 0, []
+    pdf = PdfWriter(pdf_path)
+    try:
+        for folder in map(Path, chapter_dirs):
+            pdf.add_bookmark(folder.name)
+            try:
+                with PdfReader(folder / "chapter.pdf") as reader:
+                    pages += pdf.add_pdf(reader)
+                continue
+            except Exception as e:
+                rebuilt.append((folder.name, str(e)))
+            for file in chapter_images(folder):
+                pdf.add_image(file)
+                pages += 1
+    except BaseException:
+        pdf.abort()
+        raise
+
+    if pages:
+        pdf.close()
+    else:
+        pdf.abort()
+    return pages, rebuilt
+
+
+# Build <folder>/chapter.pdf from the chapter's images. Meant to run in a
+# worker process, so it only returns plain data: the names of the pages added
+# and (name, error message) pairs for the pages that were skipped.
+def build_chapter_pdf(folder):
+    folder = Path(folder)
+    added, errors = build_pdf(chapter_images(folder), folder / "chapter.pdf")
+    return [file.name for file in added], [(file.name, str(e)) for file, e in errors]
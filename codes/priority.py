@@ -0,0 +1,78 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+
+
+# Tasks waiting for a slot, served lowest priority first (ties in arrival
+# order). Slots are handed to the waiters directly instead of letting every
+# waiter race for a freed slot, so a chapter queued later cannot overtake an
+# earlier one. key says what the slot is for (the host of a request); a
+# waiter whose key has no room is skipped, without blocking the ones behind it.
+class PriorityWaiters:
+    def __init__(self):
+        self.heap = []
+        self.arrival = itertools.count()
+
+    # Queue a waiter and wait until it is given a slot. hand_out is the owner's
+    # call to grant(), give_back(key) returns a slot that arrived too late for
+    # a waiter cancelled meanwhile. Slots are handed out on the next turn of the
+    # loop, so tasks started together are served by priority, not by which one
+    # asked first.
+    async def wait(self, priority, key, hand_out, give_back):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self.heap, (priority, next(self.arrival), key, future))
+        loop.call_soon(hand_out)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                give_back(key)
+            raise
+
+    # Hand out slots while has_room(): can_start(key) says whether a waiter's
+    # slot is free, start(key) takes it
+    def grant(self, has_room, can_start, start):
+        skipped = []
+        while self.heap and has_room():
+            entry = heapq.heappop(self.heap)
+            future = entry[3]
+            if future.done():  # Cancelled while waiting
+                continue
+            if can_start(entry[2]):
+                start(entry[2])
+                future.set_result(None)
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+
+
+# asyncio.Semaphore that lets the waiter with the lowest priority in first
+class PrioritySemaphore:
+    def __init__(self, value):
+        self.free = value
+        self.waiters = PriorityWaiters()
+
+    async def acquire(self, priority=()):
+        await self.waiters.wait(priority, None, self._grant, lambda key: self.release())
+
+    # Hold a slot while the block runs
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=()):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        self.free += 1
+        self._grant()
+
+    def _grant(self):
+        self.waiters.grant(lambda: self.free > 0, lambda key: True, self._take)
+
+    def _take(self, key):
+        self.free -= 1
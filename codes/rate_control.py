@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+
+# Statuses worth another try. All but 500 also mean the server, or the gateway
+# in front of it, is overloaded; a 500 is more likely a broken page than load.
+RETRY_STATUSES = {429, 503, 500, 502, 504}
+CONGESTION_STATUSES = {429, 502, 503, 504}
+
+
+# Seconds to wait according to a Retry-After header (delay or HTTP date), or None
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime  # HTTP dates are rare, and email is slow to import
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# How often and how long to wait before trying a request again
+class RetryPolicy:
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt, status=None, error=None):
+        if attempt >= self.max_retries:
+            return False
+        return error is not None or status in RETRY_STATUSES
+
+    # Exponential backoff with jitter; a Retry-After from the server wins if it is longer
+    def delay(self, attempt, retry_after=None):
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        backoff = backoff / 2 + random.uniform(0, backoff / 2)
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            backoff = max(backoff, min(server_delay, self.max_delay))
+        return backoff
+
+
+# AIMD state of one host: while the limit is in use, it grows by one request
+# per window of healthy responses and is halved on congestion statuses and
+# timeouts, at most once per cooldown so a burst of failures from the same
+# window only counts once.
+class HostLimit:
+    def __init__(self, initial, minimum, maximum, decrease=0.5, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+
+    def has_room(self):
+        return self.in_flight < int(self.limit)
+
+    # Update the limit after a response, returns True if its integer value changed
+    def record(self, congested):
+        before = int(self.limit)
+        if congested:
+            now = time.monotonic()
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit):  # Only grow while the limit is actually reached
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        return int(self.limit) != before
+
+
+# Shared bookkeeping of the async and threaded limiters: one HostLimit per
+# host, plus a global cap on requests in flight across all hosts.
+class AimdLimiterBase:
+    def __init__(self, max_total, initial_per_host, max_per_host, log=None):
+        self.max_total = max_total
+        self.initial_per_host = min(initial_per_host, max_per_host)
+        self.max_per_host = max_per_host
+        self.hosts = {}
+        self.in_flight = 0
+        self.log = log
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostLimit(self.initial_per_host, 1, self.max_per_host)
+        return self.hosts[host]
+
+    def _can_start(self, host):
+        return self.in_flight < self.max_total and self._host(host).has_room()
+
+    def _start(self, host):
+        self.in_flight += 1
+        self._host(host).in_flight += 1
+
+    def _finish(self, host, congested):
+        self.in_flight -= 1
+        state = self._host(host)
+        state.in_flight -= 1
+        if state.record(congested) and self.log:
+            self.log(f"Rate control {'cut' if congested else 'raised'} limit: {self.describe()}")
+
+    def describe(self):
+        hosts = ", ".join(f"{host} {state.in_flight}/{int(state.limit)}" for host, state in self.hosts.items())
+        return f"{self.in_flight}/{self.max_total} in flight [{hosts}]"
+
+
+# Requests waiting for a slot are let in by priority, lowest first
+class AsyncAimdLimiter(AimdLimiterBase):
+    def __init__(self, *args, **kwargs):
+        from priority import PriorityWaiters  # Not imported at the top, it needs asyncio and the sync downloader never does
+        super().__init__(*args, **kwargs)
+        self.waiters = PriorityWaiters()
+
+    async def acquire(self, host, priority=()):
+        await self.waiters.wait(priority, host, self._grant, self._give_back)
+
+    async def release(self, host, congested=False):
+        self._finish(host, congested)
+        self._grant()
+
+    def _give_back(self, host):
+        self.in_flight -= 1
+        self._host(host).in_flight -= 1
+        self._grant()
+
+    def _grant(self):
+        self.waiters.grant(lambda: self.in_flight < self.max_total, lambda host: self._host(host).has_room(), self._start)
+
+
+class ThreadAimdLimiter(AimdLimiterBase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = threading.Condition()
+
+    def acquire(self, host):
+        with self.condition:
+            self.condition.wait_for(lambda: self._can_start(host))
+            self._start(host)
+
+    def release(self, host, congested=False):
+        with self.condition:
+            self._finish(host, congested)
+            self.condition.notify_all()
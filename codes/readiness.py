@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from transcode import OUTPUT_DIR
+
+# Written into a chapter folder once the chapter can be read
+READY_MARKER = "chapter.ready"
+
+# Outputs of a chapter listed in its marker, when they exist
+OUTPUT_NAMES = ("chapter.pdf", "chapter.cbz", "chapter.epub", OUTPUT_DIR)
+
+
+# Chapters of a run that became readable: every page downloaded and every
+# output (package, PDF, device copies) built. Each one gets a marker file,
+# written atomically, that a reader sync can wait for instead of guessing
+# when a folder is complete; the marker is removed while the chapter is
+# downloaded or repaired again. Also times the first readable chapter.
+class ReadyTracker:
+    def __init__(self, write_markers=True):
+        self.write_markers = write_markers
+        self.started = time.perf_counter()
+        self.count = 0
+        self.first = None  # (seconds since the run started, chapter title)
+        self.lock = threading.Lock()  # The sync downloader marks chapters from transcode callbacks
+
+    # Remove the marker of a chapter that is about to change
+    def clear(self, chapter_dir):
+        if self.write_markers:
+            (Path(chapter_dir) / READY_MARKER).unlink(missing_ok=True)
+
+    # Mark a finished chapter, returns the seconds since the run started
+    def mark(self, chapter_dir, chapter_url, series_url, title):
+        seconds = time.perf_counter() - self.started
+        with self.lock:
+            self.count += 1
+            if self.first is None:
+                self.first = (seconds, str(title))
+        if self.write_markers:
+            write_marker(Path(chapter_dir), marker_fields(chapter_dir, chapter_url, series_url, title))
+        return seconds
+
+    # Mark a chapter finished before this run, if it has no marker yet
+    def ensure(self, chapter_dir, chapter_url, series_url, title):
+        if self.write_markers and Path(chapter_dir).is_dir() and read_marker(chapter_dir) is None:
+            write_marker(Path(chapter_dir), marker_fields(chapter_dir, chapter_url, series_url, title))
+
+    def describe(self):
+        if self.first is None:
+            return "No chapter became readable"
+        return f"First readable chapter after {self.first[0]:.1f}s ({self.first[1]}), {self.count} chapters ready"
+
+
+def marker_fields(chapter_dir, chapter_url, series_url, title):
+    return {
+        "chapter_url": chapter_url,
+        "series_url": series_url,
+        "title": str(title),
+        "outputs": [name for name in OUTPUT_NAMES if (Path(chapter_dir) / name).exists()],
+        "ready_at": round(time.time(), 3),
+    }
+
+
+def write_marker(chapter_dir, fields):
+    path = chapter_dir / READY_MARKER
+    part_path = path.with_name(path.name + ".part")
+    with open(part_path, 'w', encoding='utf-8') as f:
+        json.dump(fields, f, ensure_ascii=False)
+    os.replace(part_path, path)
+
+
+# Marker of a chapter folder, or None if the chapter is not ready
+def read_marker(chapter_dir):
+    try:
+        with open(Path(chapter_dir) / READY_MARKER, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
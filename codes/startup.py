@@ -0,0 +1,69 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+CODES_DIR = Path(__file__).resolve().parent
+
+# Imports listed by the report
+REPORT_TOP = 15
+
+
+# Start a fresh interpreter that imports the module and loads the config, as a
+# run does before its first request, under python -X importtime. Returns the
+# wall time in seconds and [(cumulative µs, self µs, module)] of the imports it
+# made, with nested imports indented as importtime prints them.
+def measure_startup(module):
+    import subprocess  # Not at the top: the downloaders load this module on every start
+    code = f"import sys; sys.path.insert(0, {str(CODES_DIR)!r}); import {module}; {module}.load_config()"
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    return seconds, imports
+
+
+# Wall time of an interpreter that does nothing, the floor of any startup
+def bare_startup():
+    import subprocess
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - started
+
+
+def startup_report(module, top=REPORT_TOP):
+    bare = bare_startup()
+    seconds, imports = measure_startup(module)
+    # The module is the last top-level entry; its direct imports are the entries
+    # one level deeper that importtime printed before it
+    position = max(index for index, entry in enumerate(imports) if entry[2] == module)
+    start = max((index for index, entry in enumerate(imports[:position]) if not entry[2].startswith(" ")), default=-1) + 1
+    direct = sorted((entry for entry in imports[start:position] if entry[2].startswith("  ") and not entry[2].startswith("    ")),
+                    reverse=True)
+    lines = [
+        f"Startup of {module}: {seconds * 1000:.0f} ms ({bare * 1000:.0f} ms of it is the bare interpreter)",
+        f"{len(imports)} modules imported, {imports[position][0] / 1000:.1f} ms importing {module}",
+        f"Slowest imports of {module} (ms, including what they import):",
+    ]
+    lines += [f"  {cumulative / 1000:8.1f}  {name.strip()}" for cumulative, _, name in direct[:top]]
+    return "\n".join(lines)
+
+
+# --profile-startup: print the startup report of the downloader and exit,
+# before the usual arguments are checked
+class ProfileStartupAction(argparse.Action):
+    def __init__(self, option_strings, dest, module, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs)
+        self.module = module
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(startup_report(self.module))
+        parser.exit()
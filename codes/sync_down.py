@@ -1,26 +1,81 @@
 import os
-import requests
-from PIL import Image
-from bs4 import BeautifulSoup
 from pathlib import Path
 import argparse
+import contextlib
+import itertools
+import time
+import queue
+import threading
+import sys
 import json
 import re
-from termcolor import colored
+from urllib.parse import urlsplit
+from manifest import Manifest
+from http_cache import HttpCache
+from metrics import Metrics
+from event_log import EventLog
+from blob_store import BlobStore, new_hasher
+from catalog import ChapterCatalog
+from memory_budget import PDF_DECODED_SUFFIXES, ThreadByteBudget, chapter_decode_bytes, download_bytes
+from startup import ProfileStartupAction
+from transcode import OUTPUT_DIR, Transcoder
+from rate_control import CONGESTION_STATUSES, RetryPolicy, ThreadAimdLimiter
+from extract import extract_chapters, extract_reader_page, extract_series_info, select_backend
+from pdf_writer import build_pdf, chapter_images
+from integrity import verify_pages
+from readiness import ReadyTracker
+
+# Settings from config/config.json, set by load_config
+config_data = None
+config_stamp = None
 
 # Load config
-config_path = Path.cwd() / 'config' / 'config.json'
-with open(config_path, 'r') as config_file:
-    config_data = json.load(config_file)
+# Called by every entry point instead of at import time. The file is only read
+# again once it changed, so a long-lived caller such as main.py picks up new
+# settings without paying for a reload on every run.
+def load_config():
+    global config_data, config_stamp, base_save_path, base_url
+    config_path = Path.cwd() / 'config' / 'config.json'
+    stamp = (config_path, config_path.stat().st_mtime_ns)
+    if stamp == config_stamp:
+        return config_data
+    with open(config_path, 'r') as config_file:
+        config_data = json.load(config_file)
+    config_stamp = stamp
+
+    # Determine base directory based on custom_save_path value
+    base_save_path = config_data.get("custom_save_path", False)
+
+    # Se custom_save_path è False, usa il percorso di base
+    if base_save_path is False:
+        base_save_path = Path.cwd() / 'Manga'
+    else:
+        base_save_path = Path(base_save_path)
+
+    # Site the links and relative hrefs belong to; benchmarks point it at a local stand-in
+    base_url = config_data.get("base_url", "https://mangaita.io").rstrip("/")
+
+    select_backend(config_data.get("html_parser", "auto"))
+    return config_data
 
-# Determine base directory based on custom_save_path value
-base_save_path = config_data.get("custom_save_path", False)
+# Size of the chunks streamed to disk while downloading an image
+CHUNK_SIZE = 64 * 1024
 
-# Se custom_save_path è False, usa il percorso di base
-if base_save_path is False:
-    base_save_path = Path.cwd() / 'Manga'
-else:
-    base_save_path = Path(base_save_path)
+# Download manifest, page cache, rate control and image thread pool, created by run_downloads
+manifest = None
+image_pool = None
+postprocess_pool = None
+metrics = None
+event_log = None
+blob_store = None
+transcoder = None
+chapter_catalog = None
+memory_budget = None
+ready_tracker = None
+http_cache = None
+limiter = None
+retry_policy = None
+request_timeout = None
 
 # Create Manga folder structure if allowed
 def create_manga_folder_structure():
@@ -30,6 +85,74 @@ def create_manga_folder_structure():
         return manga_dir
     return Path.cwd()  # Default to current directory if folder creation is disabled
 
+# Page cache in the library folder, or None if disabled in the config
+def create_http_cache(library_dir):
+    if not config_data.get("http_cache", True):
+        return None
+    return HttpCache(
+        library_dir / ".cache" / "http",
+        max_bytes=config_data.get("http_cache_max_mb", 100) * 1024 * 1024,
+        ttl_seconds=config_data.get("http_cache_ttl_minutes", 30) * 60,
+    )
+
+# Content-addressed image store in the library folder, or None if disabled in the config
+def create_blob_store(library_dir):
+    if not config_data.get("blob_store", False):
+        return None
+    return BlobStore(library_dir / ".blobs", config_data.get("blob_link", "hardlink"))
+
+# Budget of image bytes held in memory at once, or None without max_inflight_mb
+def create_memory_budget():
+    max_inflight_mb = config_data.get("max_inflight_mb")
+    return ThreadByteBudget(int(max_inflight_mb * 1024 * 1024)) if max_inflight_mb else None
+
+# Hold nbytes of the memory budget while the block runs, if there is a budget
+def memory_reservation(nbytes):
+    return memory_budget.hold(nbytes) if memory_budget else contextlib.nullcontext()
+
+# Stored chapter lists of the series, refreshed once older than catalog_max_age_minutes
+def create_catalog(library_dir):
+    return ChapterCatalog(library_dir / ".cache" / "catalog", config_data.get("catalog_max_age_minutes", 60) * 60)
+
+# Device-targeted copies of the pages, or None when transcoding is off
+def create_transcoder(library_dir):
+    if not config_data.get("transcode", False):
+        return None
+    return Transcoder(library_dir / ".cache" / "transcode", config_data.get("transcode_format"),
+                      config_data.get("transcode_quality", 80), config_data.get("transcode_max_width"),
+                      config_data.get("transcode_max_height"), config_data.get("transcode_grayscale", False),
+                      config_data.get("transcode_thumbnail_size"), config_data.get("blob_link", "hardlink"))
+
+# Chapter archive in the configured package_format, or None to keep loose files only
+def create_package(chapter_dir, series, chapter_title, chapter_url):
+    package_format = config_data.get("package_format")
+    if not package_format:
+        return None
+    from chapter_package import PACKAGE_FORMATS
+    number = re.search(r'\d+(?:\.\d+)?', str(chapter_title))
+    metadata = dict(series, title=str(chapter_title), url=chapter_url, number=number.group() if number else None)
+    return PACKAGE_FORMATS[package_format](chapter_dir, metadata)
+
+# Run metrics, or None if disabled in the config
+def create_metrics():
+    if not config_data.get("metrics", False):
+        return None
+    return Metrics(
+        "sync",
+        events_path=config_data.get("metrics_events"),
+        prometheus_path=config_data.get("metrics_prometheus_file"),
+        prometheus_port=config_data.get("metrics_prometheus_port"),
+    )
+
+# Writer for the download_info.txt logs, shared by every download of the run
+def create_event_log():
+    max_mb = config_data.get("log_max_mb")
+    return EventLog(
+        flush_interval=config_data.get("log_flush_seconds", 1.0),
+        max_bytes=max_mb * 1024 * 1024 if max_mb else None,
+        backup_count=config_data.get("log_backups", 3),
+    )
+
 # Create Scan folder structure if allowed
 def create_scan_folder_structure(manga_dir):
     if config_data.get("create_scan_folder", True):
@@ -41,104 +164,442 @@ def create_scan_folder_structure(manga_dir):
 # Argument parsing
 def get_args():
     parser = argparse.ArgumentParser(description='Download Manga from https://mangaita.io/')
-    parser.add_argument('-u', '--url', help='URL of the website', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-u', '--url', help='URL of the website')
+    source.add_argument('-b', '--batch', help='File with one link per line ("-" reads stdin), optionally followed by start and end chapter')
     parser.add_argument('-d', '--debug', help='Enable debug mode', action='store_true')
+    parser.add_argument('--profile-startup', action=ProfileStartupAction, module='sync_down',
+                        help='Show how long startup takes and which imports it goes to, then exit')
     parser.add_argument('-s', '--start_chapter', type=float, help='Start chapter number', default=1)
     parser.add_argument('-e', '--end_chapter', type=float, help='End chapter number', default=None)
     return parser.parse_args()
 
+# Read batch jobs: links separated by newlines or commas, each optionally
+# followed by a start and an end chapter ("<link> [start [end]]"). An entry
+# with a chapter that is not a number is reported and skipped.
+def read_batch(batch_file):
+    if batch_file == '-':
+        content = sys.stdin.read()
+    else:
+        with open(batch_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    jobs = []
+    for number, line in enumerate(content.splitlines(), 1):
+        for entry in line.split(','):
+            fields = entry.split()
+            if not fields:
+                continue
+            try:
+                start_chapter = float(fields[1]) if len(fields) > 1 else 1
+                end_chapter = float(fields[2]) if len(fields) > 2 else None
+            except ValueError:
+                print(f"Skipping line {number} of {batch_file}, the chapter is not a number: {entry.strip()}")
+                continue
+            jobs.append((fields[0], start_chapter, end_chapter))
+    return jobs
+
+# Links must belong to the site; checked before anything of a run is set up
+def valid_series_url(url):
+    if base_url + "/" in url:
+        return True
+    print(f"Invalid URL, please use {base_url}/")
+    return False
+
 # Debug print
 def debug_print(message):
     if args.debug:
+        from termcolor import colored
         print(colored(f"Debug: {message}", 'yellow'))
 
 # Download image function (synchronous version)
-def download_image(session, img_url, folder, download_info_file):
+# The body is streamed to a ".part" file in fixed-size chunks and only renamed
+# to its final name once it is complete and synced to disk
+def download_image(session, img_url, folder, download_info_file, chapter_url, package=None, order=None):
     if not img_url.startswith("http"):
-        img_url = "https://mangaita.io" + img_url  # Adjust URL if needed
+        img_url = base_url + img_url  # Adjust URL if needed
 
     img_name = os.path.basename(img_url.split("?")[0])
     img_path = folder / img_name
+    part_path = folder / (img_name + ".part")
+
+    if manifest.image_done(img_url, img_path):
+        debug_print(f"Skipping {img_name}, already downloaded")
+        if metrics:
+            metrics.image_skipped(img_url, chapter_url)
+        if package:
+            package.add_file(order, img_path)
+        return True
+
+    # An image URL already in the blob store is linked into place without downloading it again
+    if blob_store and (digest := manifest.blob_hash(img_url)) and blob_store.link(digest, img_path):
+        manifest.record_image(img_url, chapter_url, img_path, img_path.stat().st_size, order=order)
+        debug_print(f"Linked {img_name} from the blob store")
+        if package:
+            package.add_file(order, img_path)
+        if metrics:
+            metrics.image_skipped(img_url, chapter_url)
+        return True
+
+    # Retried with backoff on errors and 429/5xx, under the adaptive per-host limit
+    from requests import Timeout
+    host = urlsplit(img_url).netloc
+    debug_print(f"Downloading {img_name} from {img_url}")
+    started, ttfb = time.perf_counter(), None
+    for attempt in itertools.count():
+        status, retry_after, error = None, None, None
+        limiter.acquire(host)
+        sent = time.perf_counter()
+        try:
+            with session.get(img_url, stream=True, timeout=request_timeout) as response:
+                status = response.status_code
+                ttfb = time.perf_counter() - sent
+                if status == 200:
+                    # The body is only read once its bytes fit in the memory budget
+                    buffered = bool(package) and not config_data.get("keep_loose_files", True)
+                    content_length = response.headers.get("Content-Length")
+                    content_length = int(content_length) if content_length else None
+                    # A body shorter than the announced length is a cut download, and is retried
+                    expected_size = None if response.headers.get("Content-Encoding") else content_length
+                    with memory_reservation(download_bytes(content_length, buffered)):
+                        if buffered:
+                            # Loose files are not kept: the image only goes into the chapter package
+                            body = response.content
+                            size = len(body)
+                            if expected_size is not None and size != expected_size:
+                                raise OSError(f"Got {size} of {expected_size} bytes")
+                            package.add_bytes(order, img_path.suffix, body)
+                            debug_print(f"Downloaded {img_name} into {package.path}")
+                        else:
+                            size = 0
+                            hasher = new_hasher() if blob_store else None
+                            with open(part_path, 'wb') as f:
+                                for chunk in response.iter_content(CHUNK_SIZE):
+                                    f.write(chunk)
+                                    size += len(chunk)
+                                    if hasher:
+                                        hasher.update(chunk)
+                                f.flush()
+                                os.fsync(f.fileno())
+                            if expected_size is not None and size != expected_size:
+                                raise OSError(f"Got {size} of {expected_size} bytes")
+                            if blob_store:
+                                blob_store.add(part_path, hasher.hexdigest(), img_path)
+                                manifest.record_blob(img_url, hasher.hexdigest(), size)
+                            else:
+                                os.replace(part_path, img_path)
+                            manifest.record_image(img_url, chapter_url, img_path, size, response.headers.get("ETag"),
+                                                  response.headers.get("Last-Modified"), expected_size, order)
+                            debug_print(f"Downloaded {img_name} to {img_path}")
+                            if package:
+                                package.add_file(order, img_path)
+                        if metrics:
+                            metrics.image(img_url, chapter_url, status, ttfb, time.perf_counter() - started, size, attempt, True)
+                        return True
+                retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            error = e
+            part_path.unlink(missing_ok=True)
+        finally:
+            limiter.release(host, congested=status in CONGESTION_STATUSES or isinstance(error, Timeout))
+
+        if not retry_policy.should_retry(attempt, status, error):
+            break
+        delay = retry_policy.delay(attempt, retry_after)
+        debug_print(f"Retrying {img_name} in {delay:.1f}s after {error or f'HTTP {status}'}")
+        time.sleep(delay)
+
+    manifest.fail_image(img_url, chapter_url, img_path, error or f"HTTP {status}")
+    if metrics:
+        metrics.image(img_url, chapter_url, status, ttfb, time.perf_counter() - started, 0, attempt, False)
+    if error is None:
+        event_log.write(download_info_file, f"Error downloading {img_name}: {img_url}")
+    else:
+        event_log.write(download_info_file, f"Error downloading {img_name}: {error}")
+    return False
+
+# Fetch an HTML page through the on-disk HTTP cache, returns (status, text)
+# Errors and 429/5xx answers are retried with backoff before giving up
+def fetch_page(session, url):
+    started = time.perf_counter()
+    entry = http_cache.lookup(url) if http_cache else None
+    if entry and http_cache.fresh(entry):
+        debug_print(f"Cache hit: {url}")
+        if metrics:
+            metrics.page(url, 200, time.perf_counter() - started, 0, "cache")
+        return 200, http_cache.load(entry)
+
+    headers = http_cache.request_headers(entry) if entry else {}
+    for attempt in itertools.count():
+        status, retry_after, error = None, None, None
+        try:
+            response = session.get(url, headers=headers, timeout=request_timeout)
+            status = response.status_code
+            if status == 304 and entry:
+                debug_print(f"Not modified, using cached page: {url}")
+                if metrics:
+                    metrics.page(url, status, time.perf_counter() - started, attempt, "revalidated")
+                return 200, http_cache.revalidated(entry, response.headers)
+            if status == 200:
+                if metrics:
+                    metrics.page(url, status, time.perf_counter() - started, attempt, "network")
+                if http_cache:
+                    http_cache.store(url, response.text, response.headers)
+                return status, response.text
+            retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            error = e
+
+        if not retry_policy.should_retry(attempt, status, error):
+            break
+        delay = retry_policy.delay(attempt, retry_after)
+        debug_print(f"Retrying {url} in {delay:.1f}s after {error or f'HTTP {status}'}")
+        time.sleep(delay)
+
+    if metrics:
+        metrics.page(url, status, time.perf_counter() - started, attempt, "network")
+    if error is not None:
+        raise error
+    return status, response.text
+
+# Put an item on the page queue, giving up if the consumer has stopped
+def put_page(pages, item, stop):
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+# Reader page crawler (synchronous version): runs in its own thread and walks
+# the btn-next chain iteratively, reading the next link of each page before its
+# images are downloaded. A repeated URL ends the chain, and None marks the end
+# of the chapter; a page that could not be fetched is sent as (url, None).
+def crawl_pages(session, url, pages, download_info_file, stop):
+    seen = set()
+    while url and not stop.is_set():
+        if url in seen:
+            debug_print(f"Next page URL already visited, stopping: {url}")
+            break
+        seen.add(url)
+
+        try:
+            status, text = fetch_page(session, url)
+            if status != 200:
+                raise ValueError(f"HTTP {status}")
+            parse_started = time.perf_counter()
+            img_srcs, next_href = extract_reader_page(text)
+            if metrics:
+                metrics.parse(url, time.perf_counter() - parse_started)
+        except Exception:
+            event_log.write(download_info_file, f"Error fetching page: {url}")
+            put_page(pages, (url, None), stop)
+            break
+
+        next_url = None
+        if next_href:
+            next_url = base_url + next_href
+            debug_print(f"Next page URL: {next_url}")
 
+        put_page(pages, (url, img_srcs), stop)  # Waits while the lookahead is full
+        url = next_url
+    put_page(pages, None, stop)
+
+# Get images for a chapter (synchronous version), returns True if every page and image was downloaded
+# The images of a page download in parallel on the image pool, and up to
+# page_lookahead pages are fetched ahead of the ones still downloading.
+# Images go into the chapter package, if any, at their (page, image) position in reader order.
+def get_images(session, url, folder, download_info_file, package=None):
+    lookahead = max(1, config_data.get("page_lookahead", 2))
+    pages = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    crawler = threading.Thread(target=crawl_pages, args=(session, url, pages, download_info_file, stop), daemon=True)
+    crawler.start()
+
+    ok = True
+    pages_in_flight = []
+    page_number = 0
     try:
-        debug_print(f"Downloading {img_name} from {img_url}")
-        response = requests.get(img_url)
-        if response.status_code == 200:
-            with open(img_path, 'wb') as f:
-                f.write(response.content)
-            debug_print(f"Downloaded {img_name} to {img_path}")
-        else:
-            with open(download_info_file, 'a') as df:
-                df.write(f"Error downloading {img_name}: {img_url}\n")
-    except Exception as e:
-        with open(download_info_file, 'a') as df:
-            df.write(f"Error downloading {img_name}: {e}\n")
-
-# Get images for a chapter (synchronous version)
-def get_images(session, url, folder, download_info_file):
-    response = requests.get(url)
-    if response.status_code != 200:
-        with open(download_info_file, 'a') as df:
-            df.write(f"Error fetching page: {url}\n")
+        while (page := pages.get()) is not None:
+            page_url, img_srcs = page
+            if img_srcs is None:
+                ok = False
+                continue
+
+            page_number += 1
+            pages_in_flight.append([image_pool.submit(download_image, session, src, folder, download_info_file, url,
+                                                      package, (page_number, index))
+                                    for index, src in enumerate(img_srcs)])
+            if len(pages_in_flight) > lookahead:
+                ok = all(future.result() for future in pages_in_flight.pop(0)) and ok
+
+        for page_images in pages_in_flight:
+            ok = all(future.result() for future in page_images) and ok
+    finally:
+        stop.set()
+        crawler.join()
+    return ok
+
+# Pages of a downloaded chapter that fail the integrity check, checked in the
+# post-processing pool: [(image url, problem)]. Pages are compared with the
+# Content-Length they were sent with, or else the size they were saved with.
+def find_broken_pages(chapter_url, full=False):
+    pages = [(img_url, path, expected_size if expected_size is not None else size)
+             for img_url, path, size, expected_size in manifest.chapter_images(chapter_url)]
+    if not pages:
         return []
+    return postprocess_pool.submit(verify_pages, pages, full).result()
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    img_tags = soup.find_all("img")
+# Check the pages of a chapter just downloaded and download the broken ones
+# again, before its outputs are built. Returns (True if every page passes in
+# the end, the chapter package rebuilt from the repaired files).
+def repair_broken_pages(session, series, chapter_title, chapter_url, chapter_dir, download_info_path, package):
+    full = config_data.get("verify_full_decode", False)
+    broken = find_broken_pages(chapter_url, full)
+    if not broken:
+        return True, package
+    for img_url, problem in broken:
+        print(f"Broken page {img_url}: {problem}")
+    ok = refetch_images(session, chapter_url, chapter_dir, download_info_path, [img_url for img_url, _ in broken])
+    for img_url, problem in find_broken_pages(chapter_url, full):
+        print(f"Still broken after downloading it again: {img_url}: {problem}")
+        ok = False
+    if package:  # It holds the broken pages, build it again from the repaired files
+        package.abort()
+        package = package_from_files(chapter_dir, series, chapter_title, chapter_url)
+    return ok, package
 
-    for img in img_tags:
-        src = img.get("src")
-        if src and "logo.2c1c1f72.webp" not in src:
-            download_image(session, src, folder, download_info_file)
+# Download pages again from the site, whatever the manifest or blob store know about them.
+# A page in the blob store is usually a link to its blob, so the blob was damaged
+# with it: it is dropped from the store and the fresh download takes its place.
+# Every other page linked to the damaged blob, in any chapter, is then linked
+# to the fresh one, so the pages keep sharing one file.
+def refetch_images(session, chapter_url, chapter_dir, download_info_path, img_urls):
+    event_log.write(download_info_path, f"Downloading {len(img_urls)} broken pages again: {chapter_url}")
+    orders = {img_url: (page, image) for img_url, _, page, image in manifest.page_order(chapter_url)}
+    replaced = set()
+    for img_url in img_urls:
+        img_path = chapter_dir / os.path.basename(img_url.split("?")[0])
+        digest = manifest.blob_hash(img_url)
+        if blob_store and digest:
+            blob_store.discard(digest, img_path.suffix)
+            replaced.add(digest)
+        manifest.forget_image(img_url, img_path)
+    futures = [image_pool.submit(download_image, session, img_url, chapter_dir, download_info_path, chapter_url,
+                                 order=orders.get(img_url)) for img_url in img_urls]
+    ok = all([future.result() for future in futures])
+    for digest in replaced:
+        for path in manifest.blob_paths(digest):
+            blob_store.link(digest, Path(path))
+    return ok
 
-    next_button = soup.find("a", class_="btn btn-primary btn-navigation btn-next")
-    if next_button and next_button.get("href"):
-        next_url = "https://mangaita.io" + next_button["href"]
-        debug_print(f"Next page URL: {next_url}")
-        get_images(session, next_url, folder, download_info_file)
+# Chapter archive filled from the loose files of the chapter folder, in the
+# reader order recorded in the manifest. Chapters downloaded before the order
+# was recorded fall back to the order of the file names.
+def package_from_files(chapter_dir, series, chapter_title, chapter_url):
+    package = create_package(chapter_dir, series, chapter_title, chapter_url)
+    files = chapter_images(chapter_dir)
+    orders = {Path(path): (page, image) for _, path, page, image in manifest.page_order(chapter_url)}
+    if not all(path in orders for path in files):
+        orders = {path: (index, 0) for index, path in enumerate(files)}
+    for path in files:
+        package.add_file(orders[path], path)
+    return package
 
 # Create PDF from images in a folder
-def create_pdf_from_images(folder):
+def create_pdf_from_images(folder, chapter_url):
     if not config_data.get("create_pdf", False):
         print("PDF creation is disabled in the config file.")
         return
+    if config_data.get("package_format") and not config_data.get("keep_loose_files", True):
+        print("PDF creation needs the loose image files, which keep_loose_files turns off.")
+        return
 
-    images = []
-    sorted_files = sorted(
-        folder.iterdir(),
-        key=lambda x: float(re.search(r'(\d+\.\d+|\d+)', x.name).group()) if re.search(r'(\d+\.\d+|\d+)', x.name) else float('inf')
-    )
+    pdf_path = folder / "chapter.pdf"
+    try:
+        with memory_reservation(chapter_decode_bytes(folder, PDF_DECODED_SUFFIXES) if memory_budget else 0):
+            started = time.perf_counter()
+            added, errors = build_pdf(chapter_images(folder), pdf_path)
+    except Exception as e:
+        print(f"Error creating PDF in folder {folder}: {e}")
+        return
+    if metrics:
+        metrics.pdf(chapter_url, time.perf_counter() - started, len(added))
 
-    for file in sorted_files:
-        if file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp']:
-            try:
-                im = Image.open(file)
-                if im.mode != "RGB":
-                    im = im.convert("RGB")
-                images.append(im)
-                debug_print(f"Image {file.name} added to PDF list.")
-            except Exception as e:
-                print(f"Error processing image {file}: {e}")
-    
-    if images:
-        pdf_path = folder / "chapter.pdf"
-        try:
-            images[0].save(pdf_path, save_all=True, append_images=images[1:])
-            print(f"PDF created for chapter: {pdf_path}")
-        except Exception as e:
-            print(f"Error creating PDF in folder {folder}: {e}")
+    for file, e in errors:
+        print(f"Error processing image {file}: {e}")
+    for file in added:
+        debug_print(f"Image {file.name} added to PDF.")
+
+    if added:
+        print(f"PDF created for chapter: {pdf_path}")
     else:
         print(f"No valid images found in folder {folder} for PDF creation.")
 
-# Download manga or chapter (synchronous version)
-def get_manga(args):
-    url = args.url
-    start_chapter = args.start_chapter
-    end_chapter = args.end_chapter if args.end_chapter else float('inf')  # Se end_chapter non è specificato, va fino all'ultimo capitolo
-    
-    if "https://mangaita.io/" not in url:
-        print("Invalid URL, please use https://mangaita.io/")
+# Transcode the chapter's pages for the reader devices in a worker process,
+# while the next chapter downloads; the result is reported when it is done
+def transcode_images(folder, chapter_url):
+    if not transcoder:
+        return
+    if config_data.get("package_format") and not config_data.get("keep_loose_files", True):
+        print("Transcoding needs the loose image files, which keep_loose_files turns off.")
+        return
+
+    # Held from submission until the worker is done, so queued chapters wait for memory here
+    decode_bytes = memory_budget.reserve(chapter_decode_bytes(folder)) if memory_budget else 0
+    started = time.perf_counter()
+
+    def report(future):
+        if memory_budget:
+            memory_budget.release(decode_bytes)
+        try:
+            written, cached, errors = future.result()
+        except Exception as e:
+            print(f"Error transcoding images in folder {folder}: {e}")
+            return
+        if metrics:
+            metrics.transcode(chapter_url, time.perf_counter() - started, written, cached)
+        for name, e in errors:
+            print(f"Error transcoding image {folder / name}: {e}")
+        print(f"Transcoded images for chapter: {folder / OUTPUT_DIR} ({written} encoded, {cached} cached)")
+
+    future = postprocess_pool.submit(transcoder.run, folder)
+    future.add_done_callback(report)
+    return future
+
+# Close the chapter archive once every page is in it
+def finish_package(package):
+    try:
+        pages = package.close()
+    except Exception as e:
+        print(f"Error creating {package.path}: {e}")
         return
+    if pages:
+        print(f"{package.suffix[1:].upper()} created for chapter: {package.path}")
+    else:
+        print(f"No pages to package in folder {package.path.parent}.")
+
+# Chapter catalog of a series: the stored one while it is fresh, otherwise the
+# series page is fetched and parsed again. None if the page could not be fetched.
+def series_catalog(session, url, end_chapter=None):
+    catalog = chapter_catalog.lookup(url, end_chapter)
+    if catalog:
+        debug_print(f"Using the stored chapter list of {url}")
+        return catalog
+
+    status, text = fetch_page(session, url)
+    if status != 200:
+        return None
+
+    parse_started = time.perf_counter()
+    listing = [(title, base_url + href) for title, href in extract_chapters(text)]
+    series = extract_series_info(text)
+    if metrics:
+        metrics.parse(url, time.perf_counter() - parse_started)
+    return chapter_catalog.store(url, series, listing)
 
+# Download manga or chapter (synchronous version)
+def get_manga(session, url, start_chapter=1, end_chapter=None):
     manga_name = Path(url.split("/")[-1])
 
     # Use the custom manga folder or the default one
@@ -148,51 +609,146 @@ def get_manga(args):
     manga_dir.mkdir(parents=True, exist_ok=True)
 
     download_info_path = manga_dir / 'download_info.txt'
-    with open(download_info_path, 'w') as df:
-        df.write(f"Download started for manga: {manga_name}\n")
+    event_log.write(download_info_path, f"Download started for manga: {manga_name}")
 
-    response = requests.get(url)
-    if response.status_code != 200:
+    catalog = series_catalog(session, url, end_chapter)
+    if catalog is None:
         print("Failed to retrieve the webpage")
         return
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    chapter_divs = soup.find_all("div", class_="col-chapter")
+    chapters = catalog.select(start_chapter, end_chapter)
     if config_data.get("latest_first", False):
-        chapter_divs = reversed(chapter_divs)
+        chapters.reverse()
+
+    for _, title, chapter_url in chapters:
+        chapter_title = Path(title)
+        chapter_dir = scan_dir / chapter_title
+        if manifest.chapter_done(chapter_url):
+            print(f"Skipping chapter: {chapter_title} (already downloaded)")
+            ready_tracker.ensure(chapter_dir, chapter_url, url, chapter_title)
+            continue
+
+        started = time.perf_counter()
+        chapter_dir.mkdir(parents=True, exist_ok=True)
+        ready_tracker.clear(chapter_dir)
+        manifest.start_chapter(chapter_url, url, chapter_title, chapter_dir)
 
-    for chapter in chapter_divs:
-        link_tag = chapter.find("a")
-        title_tag = chapter.find("h5")
-        if link_tag and title_tag:
-            chapter_title = Path(title_tag.text.strip().split("\n")[0])
-            chapter_url = "https://mangaita.io" + link_tag["href"]
+        print(f"Processing chapter: {chapter_title}")
+        event_log.write(download_info_path, f"Processing chapter: {chapter_title}")
+        package = create_package(chapter_dir, catalog.series, chapter_title, chapter_url)
+        ok = get_images(session, chapter_url, chapter_dir, download_info_path, package)
+        if config_data.get("verify_downloads", False):
+            intact, package = repair_broken_pages(session, catalog.series, chapter_title, chapter_url, chapter_dir,
+                                                  download_info_path, package)
+            ok = intact and ok
+        if package:
+            finish_package(package)
+        transcoding = transcode_images(chapter_dir, chapter_url)
+        create_pdf_from_images(chapter_dir, chapter_url)
+        manifest.finish_chapter(chapter_url, ok)
+        if ok and transcoding:
+            # The device copies are still being made in the pool while the next chapter downloads
+            transcoding.add_done_callback(lambda _, chapter=(chapter_dir, chapter_url, url, chapter_title, download_info_path):
+                                          mark_ready(*chapter))
+        elif ok:
+            mark_ready(chapter_dir, chapter_url, url, chapter_title, download_info_path)
+        if metrics:
+            metrics.chapter(chapter_url, chapter_title, time.perf_counter() - started, ok)
 
-            # Estrai il numero del capitolo
-            chapter_number = int(re.search(r'\d+', str(chapter_title)).group())
+# Chapters are downloaded one after the other in reading order, each is
+# readable once its pages and every output are done
+def mark_ready(chapter_dir, chapter_url, series_url, chapter_title, download_info_path):
+    seconds = ready_tracker.mark(chapter_dir, chapter_url, series_url, chapter_title)
+    event_log.write(download_info_path, f"Chapter ready: {chapter_title}")
+    if metrics:
+        metrics.chapter_ready(chapter_url, chapter_title, seconds)
 
-            # Se il capitolo è nel range specificato, scaricalo
-            if start_chapter <= chapter_number <= end_chapter:
-                chapter_dir = scan_dir / chapter_title
-                chapter_dir.mkdir(parents=True, exist_ok=True)
+# Download engine (synchronous version): runs every (url, start_chapter, end_chapter) job in this process
+def run_downloads(jobs):
+    # The HTTP client and process pool are imported here, not at startup,
+    # so runs that stop early (a bad link, -h) do not pay for them
+    import requests
+    from requests.adapters import HTTPAdapter
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    global manifest, http_cache, limiter, retry_policy, request_timeout, image_pool, postprocess_pool, metrics, event_log, blob_store, transcoder, chapter_catalog, memory_budget, ready_tracker
 
-                print(f"Processing chapter: {chapter_title}")
-                with open(download_info_path, 'a') as df:
-                    df.write(f"Processing chapter: {chapter_title}\n")
-                get_images(None, chapter_url, chapter_dir, download_info_path)
-                create_pdf_from_images(chapter_dir)
+    # The manifest lets a rerun skip what is already on disk
+    library_dir = create_manga_folder_structure()
+    manifest = Manifest(library_dir)
+    http_cache = create_http_cache(library_dir)
+    blob_store = create_blob_store(library_dir)
+    transcoder = create_transcoder(library_dir)
+    chapter_catalog = create_catalog(library_dir)
+    memory_budget = create_memory_budget()
+    metrics = create_metrics()
+    event_log = create_event_log()
+    ready_tracker = ReadyTracker(config_data.get("ready_markers", False))
 
-            # Se il capitolo supera l'intervallo, interrompi
-            if chapter_number > end_chapter:
-                break
+    # Each host's request limit grows while responses are healthy and is cut on 429/502/503/504/timeouts
+    limiter = ThreadAimdLimiter(config_data.get("max_connections", 16), config_data.get("initial_connections_per_host", 4),
+                                config_data.get("max_connections_per_host", 8), log=debug_print)
+    retry_policy = RetryPolicy(config_data.get("max_retries", 3), config_data.get("retry_base_delay", 1.0),
+                               config_data.get("retry_max_delay", 60))
+    request_timeout = config_data.get("request_timeout", 60)
 
+    # One session for every request, with a connection pool big enough for all the workers
+    workers = config_data.get("sync_workers", 8)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers + config_data.get("page_lookahead", 2) + 1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    debug_print(f"Running {len(jobs)} jobs with {workers} image download threads")
+
+    # Transcoding runs in worker processes, which are only started once a chapter needs them
+    postprocess_pool = ProcessPoolExecutor(max_workers=config_data.get("postprocess_workers") or None)
+    # The manifest, logs and metrics are closed even if the run is interrupted,
+    # so the lines and the summary gathered so far are written out
+    try:
+        with session, ThreadPoolExecutor(max_workers=workers) as image_pool, postprocess_pool:
+            for url, start_chapter, end_chapter in jobs:
+                try:
+                    get_manga(session, url, start_chapter, end_chapter)
+                except Exception as e:
+                    print(f"Error downloading {url}: {e}")
+    finally:
+        debug_print(f"Rate control final state: {limiter.describe()}")
+        if ready_tracker.count:
+            print(ready_tracker.describe())
+        if memory_budget:
+            print(f"Memory budget: {memory_budget.describe()}")
+            if metrics:
+                metrics.event("memory", peak_bytes=memory_budget.peak, budget_bytes=memory_budget.limit)
+        manifest.close()
+        event_log.close()
+        close_metrics(library_dir)
     print("Download finished.")
 
+# Write the run's metrics summary next to the manifest
+def close_metrics(library_dir):
+    global metrics
+    if metrics:
+        summary_path = config_data.get("metrics_summary") or library_dir / "metrics.json"
+        metrics.close(summary_path)
+        metrics = None
+        print(f"Metrics written to {summary_path}")
+
+# Entry point for in-process callers such as main.py: one startup for any number of links
+def run_batch(jobs, debug=False):
+    global args
+    args = argparse.Namespace(debug=debug)
+    load_config()
+    jobs = [job for job in jobs if valid_series_url(job[0])]
+    if jobs:
+        run_downloads(jobs)
+
 # Main function
 def main():
-    global args
-    args = get_args()
-    get_manga(args)
+    cli_args = get_args()
+    if cli_args.batch:
+        jobs = read_batch(cli_args.batch)
+    else:
+        jobs = [(cli_args.url, cli_args.start_chapter, cli_args.end_chapter)]
+    run_batch(jobs, cli_args.debug)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+from pathlib import Path
+
+from blob_store import BlobStore, new_hasher
+from pdf_writer import chapter_images
+
+# Output formats: file suffix and Pillow format name
+OUTPUT_FORMATS = {
+    "jpeg": (".jpg", "JPEG"),
+    "webp": (".webp", "WEBP"),
+    "avif": (".avif", "AVIF"),
+}
+SOURCE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+# Folders inside the chapter folder that receive the outputs
+OUTPUT_DIR = "device"
+THUMBS_DIR = "thumbs"
+
+THUMBNAIL_QUALITY = 75
+CHUNK_SIZE = 1024 * 1024
+
+
+# Device-targeted copies of the downloaded pages: shrunk to fit the reader
+# screen, re-encoded in another format or quality, optionally grayscale for
+# e-ink, plus small thumbnails. run() handles one chapter folder and is meant
+# to run in a worker process. Every output is kept in a cache keyed by the
+# SHA-256 of its source and a hash of the settings (stored like the blob
+# store), and linked into the chapter folder, so a rerun, or a page repeated
+# in many chapters, is only encoded once.
+class Transcoder:
+    def __init__(self, cache_dir, image_format=None, quality=80, max_width=None, max_height=None,
+                 grayscale=False, thumbnail_size=None, link_mode="hardlink"):
+        if image_format and image_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown transcode_format {image_format!r}, use one of {', '.join(OUTPUT_FORMATS)}")
+        self.cache_dir = Path(cache_dir)
+        self.image_format = image_format
+        self.quality = quality
+        self.max_size = (max_width, max_height) if max_width or max_height else None
+        self.grayscale = grayscale
+        self.thumbnail_size = thumbnail_size
+        self.link_mode = link_mode
+        self.tag = settings_tag("page", image_format, quality, self.max_size, grayscale)
+        self.thumbnail_tag = settings_tag("thumb", image_format, THUMBNAIL_QUALITY, thumbnail_size, grayscale)
+
+    # Transcode every page of a chapter folder, returns (written, cached, [(name, error)])
+    def run(self, folder):
+        folder = Path(folder)
+        store = BlobStore(self.cache_dir, self.link_mode)
+        written, cached, errors = 0, 0, []
+        for path in chapter_images(folder):
+            try:
+                digest = file_digest(path)
+                variants = [(folder / OUTPUT_DIR, self.tag, self.max_size, self.quality)]
+                if self.thumbnail_size:
+                    variants.append((folder / THUMBS_DIR, self.thumbnail_tag,
+                                     (self.thumbnail_size, self.thumbnail_size), THUMBNAIL_QUALITY))
+                for out_dir, tag, max_size, quality in variants:
+                    suffix, pil_format = self.output_format(path)
+                    dest = out_dir / (path.stem + suffix)
+                    key = f"{digest}-{tag}"
+                    out_dir.mkdir(exist_ok=True)
+                    if store.link(key, dest):
+                        cached += 1
+                        continue
+                    part_path = dest.with_name(dest.name + ".part")
+                    self.encode(path, part_path, pil_format, max_size, quality)
+                    store.add(part_path, key, dest)
+                    written += 1
+            except Exception as e:
+                errors.append((path.name, str(e)))
+        return written, cached, errors
+
+    def output_format(self, path):
+        if self.image_format:
+            return OUTPUT_FORMATS[self.image_format]
+        return path.suffix.lower(), SOURCE_FORMATS.get(path.suffix.lower(), "JPEG")
+
+    def encode(self, path, part_path, pil_format, max_size, quality):
+        from PIL import Image  # Only needed when something has to be encoded
+
+        with Image.open(path) as im:
+            if max_size:
+                # Shrinks only; JPEGs are decoded at a reduced scale straight away
+                width, height = max_size
+                im.thumbnail((width or im.width, height or im.height), Image.LANCZOS)
+            if self.grayscale:
+                im = im.convert("L")
+            elif im.mode not in ("RGB", "L"):
+                alpha = pil_format != "JPEG" and (im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info)
+                im = im.convert("RGBA" if alpha else "RGB")
+            options = {} if pil_format == "PNG" else {"quality": quality}
+            im.save(part_path, format=pil_format, **options)
+
+
+# Short hash of the settings an output depends on, part of its cache key
+def settings_tag(*settings):
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:12]
+
+
+def file_digest(path):
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import async_down as engine
+from integrity import verify_pages
+from manifest import Manifest
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Check the downloaded pages of the library and repair broken ones')
+    parser.add_argument('series', nargs='*', help='URLs of the series to check, default: the whole library')
+    parser.add_argument('-f', '--full', help='Also decode every page (slower)', action='store_true')
+    parser.add_argument('-r', '--repair', help='Download broken pages again and rebuild their chapter outputs', action='store_true')
+    parser.add_argument('-d', '--debug', help='Enable debug mode', action='store_true')
+    return parser.parse_args()
+
+
+# Chapters to check and their pages, from the manifest: [(chapter row, [(image url, path, expected size)])].
+# A page is compared with the Content-Length it was sent with, or else the size it was saved with.
+def collect_pages(manifest, series_urls):
+    rows = itertools.chain.from_iterable(manifest.chapters(url) for url in series_urls) if series_urls else manifest.chapters()
+    chapters = []
+    for chapter in rows:
+        if not Path(chapter[3]).is_dir():
+            continue
+        pages = [(img_url, path, expected_size if expected_size is not None else size)
+                 for img_url, path, size, expected_size in manifest.chapter_images(chapter[0])]
+        if pages:
+            chapters.append((chapter, pages))
+    return chapters
+
+
+# Check every page in worker processes, one chapter per task.
+# Returns [(chapter row, [(image url, problem)])] of the chapters with broken pages.
+def verify_library(chapters, full):
+    with ProcessPoolExecutor(max_workers=engine.config_data.get("postprocess_workers") or None) as pool:
+        results = pool.map(verify_pages, [pages for _, pages in chapters], itertools.repeat(full), chunksize=4)
+        return [(chapter, broken) for (chapter, _), broken in zip(chapters, results) if broken]
+
+
+# Repair the damaged chapters in one downloader run, returns how many are complete again
+async def repair(damaged, full):
+    repaired = 0
+    async with engine.download_run() as session:
+        for (chapter_url, series_url, title, folder), broken in damaged:
+            _, download_info_path = engine.series_folders(series_url)
+            print(f"Repairing {title}: {len(broken)} pages")
+            if await engine.repair_chapter(session, series_url, Path(title), chapter_url, Path(folder),
+                                           download_info_path, [img_url for img_url, _ in broken], full):
+                repaired += 1
+    return repaired
+
+
+def main():
+    cli_args = get_args()
+    engine.args = argparse.Namespace(debug=cli_args.debug)
+    engine.load_config()
+
+    manifest = Manifest(engine.create_manga_folder_structure())
+    chapters = collect_pages(manifest, cli_args.series)
+    manifest.close()
+
+    started = time.perf_counter()
+    damaged = verify_library(chapters, cli_args.full)
+    pages = sum(len(chapter_pages) for _, chapter_pages in chapters)
+    broken_pages = sum(len(broken) for _, broken in damaged)
+    for (_, _, title, folder), broken in damaged:
+        for img_url, problem in broken:
+            print(f"{Path(folder).name}: {img_url}: {problem}")
+    print(f"Checked {pages} pages in {len(chapters)} chapters in {time.perf_counter() - started:.1f}s: "
+          f"{broken_pages} broken in {len(damaged)} chapters")
+
+    left = len(damaged)
+    if damaged and cli_args.repair:
+        left -= asyncio.run(repair(damaged, cli_args.full))
+        print(f"Repaired {len(damaged) - left} of {len(damaged)} chapters.")
+    # Broken pages left make the exit status non-zero, for scripts and cron
+    if left:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import async_down as engine
+from catalog import chapter_number
+from pdf_writer import build_volume, chapter_images
+
+MB = 1024 * 1024
+
+
+# Argument parsing
+def get_args():
+    parser = argparse.ArgumentParser(description='Merge the chapter PDFs of a downloaded series into volume PDFs')
+    parser.add_argument('series', help='URL of the series')
+    parser.add_argument('-r', '--range', action='append', default=[], type=parse_range, metavar='START-END',
+                        help='Chapters of one volume, e.g. 1-10 (repeatable), default: every chapter')
+    parser.add_argument('-s', '--size-mb', type=float, help='Split the chapters into volumes of at most this many MB')
+    parser.add_argument('-o', '--output', type=Path, help='Folder of the volumes, default: Volumes in the series folder')
+    parser.add_argument('-f', '--force', help='Build volumes again even if they are up to date', action='store_true')
+    parser.add_argument('-d', '--debug', help='Enable debug mode', action='store_true')
+    return parser.parse_args()
+
+
+def parse_range(text):
+    start, _, end = text.partition("-")
+    try:
+        return float(start), float(end) if end else float(start)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid chapter range: {text}")
+
+
+# Downloaded chapters of a series: [(number, folder)] sorted by chapter number
+def series_chapters(scan_dir):
+    chapters = [(chapter_number(folder.name), folder) for folder in scan_dir.iterdir() if folder.is_dir()]
+    return sorted(chapter for chapter in chapters if chapter[0] is not None)
+
+
+# What a chapter adds to a volume: its PDF, or its images if it has none
+def chapter_sources(folder):
+    pdf_path = folder / "chapter.pdf"
+    return [pdf_path] if pdf_path.exists() else chapter_images(folder)
+
+
+# Consecutive chapters grouped into volumes of at most max_bytes; a chapter
+# larger than that gets a volume of its own
+def split_by_size(chapters, max_bytes):
+    volumes, current, size = [], [], 0
+    for chapter in chapters:
+        chapter_size = sum(path.stat().st_size for path in chapter_sources(chapter[1]))
+        if current and size + chapter_size > max_bytes:
+            volumes.append(current)
+            current, size = [], 0
+        current.append(chapter)
+        size += chapter_size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+# File name of a volume: the series and its chapter range
+def volume_name(series_name, chapters):
+    first, last = f"{chapters[0][0]:g}", f"{chapters[-1][0]:g}"
+    return f"{series_name} {first}.pdf" if first == last else f"{series_name} {first}-{last}.pdf"
+
+
+# A volume is up to date if it is newer than every chapter it is made of
+def up_to_date(path, chapters):
+    if not path.exists():
+        return False
+    built = path.stat().st_mtime
+    return all(source.stat().st_mtime <= built for _, folder in chapters for source in chapter_sources(folder))
+
+
+def main():
+    cli_args = get_args()
+    engine.args = argparse.Namespace(debug=cli_args.debug)
+    engine.load_config()
+    if not engine.valid_series_url(cli_args.series):
+        sys.exit(1)
+
+    scan_dir, download_info_path = engine.series_folders(cli_args.series)
+    chapters = series_chapters(scan_dir)
+    groups = [[chapter for chapter in chapters if start <= chapter[0] <= end] for start, end in cli_args.range] or [chapters]
+    if cli_args.size_mb:
+        groups = [volume for group in groups for volume in split_by_size(group, cli_args.size_mb * MB)]
+    groups = [group for group in groups if group]
+    if not groups:
+        print(f"No downloaded chapters to merge in {scan_dir}")
+        sys.exit(1)
+
+    series_name = cli_args.series.rstrip("/").split("/")[-1]
+    output_dir = cli_args.output or download_info_path.parent / "Volumes"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for group in groups:
+        path = output_dir / volume_name(series_name, group)
+        if not cli_args.force and up_to_date(path, group):
+            print(f"Up to date: {path}")
+            continue
+
+        started = time.perf_counter()
+        pages, rebuilt = build_volume([folder for _, folder in group], path)
+        for title, error in rebuilt:
+            print(f"{title}: chapter.pdf could not be copied ({error}), added from its images")
+        if pages:
+            print(f"Volume created: {path} ({len(group)} chapters, {pages} pages in {time.perf_counter() - started:.1f}s"
+                  + (f", {len(rebuilt)} chapters from their images)" if rebuilt else ")"))
+        else:
+            print(f"No pages found for {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import os
-import subprocess
+import sys
 import time
 import json
+import importlib
+
+# The downloaders live in codes/ and are imported in-process
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codes'))
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -37,10 +41,14 @@ try:
 except FileNotFoundError:
     print("Error: Configuration file not found.")
 
-if config['download_type'] == "sync":
-    down = os.path.join('codes', 'sync_down.py')
-else:
-    down = os.path.join('codes', 'async_down.py')
+# Downloader engine for the configured download type, imported once and reused
+def get_engine():
+    try:
+        with open(config_path, 'r') as f:
+            download_type = json.load(f).get('download_type', 'async')
+    except (FileNotFoundError, json.JSONDecodeError):
+        download_type = config['download_type']
+    return importlib.import_module('sync_down' if download_type == "sync" else 'async_down')
 
 
 
@@ -89,16 +97,11 @@ def download_specific_posts():
         input("\nPress Enter to continue...")
         return
 
-    for link in links:
-        try:
-            subprocess.run(['python', down, '-u', link], check=True)
-
-        except IndexError:
-            print(f"Link format error: {link}")
-        except subprocess.CalledProcessError:
-            print(f"Error downloading the post: {link}")
-        except Exception as e:
-            print(f"Unexpected error: {link}, {str(e)}")
+    # All the links go to one engine run, sharing its session and connection pool
+    try:
+        get_engine().run_batch([(link, 1, None) for link in links])
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
 
     input("\nPress Enter to continue...")
 
@@ -106,11 +109,11 @@ def download_chapters_range():
     while True:  # Loop per assicurarsi che l'utente possa scaricare in un singolo ciclo
         try:
             link = input("Enter the link of the manga: ")
-            start_page = int(input("Enter the start chapter (0, 1, 2, etc.): "))
+            start_page = float(input("Enter the start chapter (0, 1, 2, 10.5, etc.): "))
             end_page = input("Enter the final chapter (300, 350, 400): ")
             
             if end_page != "":
-                end_page = int(end_page)
+                end_page = float(end_page)
             else:
                 end_page = start_page  # Imposta end_page uguale a start_page se non specificato
             
@@ -130,12 +133,10 @@ def download_chapters_range():
             return
 
         try:
+            # The range is looked up in the stored chapter catalog of the series, so
+            # repeated requests for the same manga do not fetch its page again.
             # Se end_page non è stato specificato, scarica solo il capitolo di partenza
-            if end_page == start_page:
-                subprocess.run(['python', down, '-u', link, '-s', str(start_page)], check=True)
-            else:
-                # Se end_page è specificato, scarica il range completo
-                subprocess.run(['python', down, '-u', link, '-s', str(start_page), '-e', str(end_page)], check=True)
+            get_engine().run_batch([(link, start_page, end_page)])
 
             # Dopo il download, chiedi se l'utente vuole scaricare altri capitoli
             print("Download completed successfully.")
@@ -143,8 +144,6 @@ def download_chapters_range():
             if continue_choice != 'y':
                 break  # Esce dal ciclo e ritorna al menu
 
-        except subprocess.CalledProcessError:
-            print(f"Error downloading the chapters: {link}")
         except Exception as e:
             print(f"Unexpected error: {str(e)}")
     
@@ -253,8 +252,8 @@ def main_menu():
                 input("\nPress Enter to continue...")
             else:
                 try:
-                    subprocess.run(['python', down, '-u', link], check=True)
-                except subprocess.CalledProcessError as e:
+                    get_engine().run_batch([(link, 1, None)])
+                except Exception as e:
                     print(f"Error occurred: {e}")
                     input("\nPress Enter to continue...")
 